@@ -1,6 +1,9 @@
 from __future__ import with_statement
 from itertools import cycle
 from signal import signal, SIGWINCH
+from threading import RLock, Timer
+
+from noseprogressive.timing import clock
 
 
 __all__ = ['ProgressBar', 'NullProgressBar']
@@ -8,15 +11,62 @@ __all__ = ['ProgressBar', 'NullProgressBar']
 
 class ProgressBar(object):
     _is_dodging = 0  # Like a semaphore
+    GRAPH_WIDTH = 14
+    BLOCK_WIDTH = 3  # of the moving block in an indeterminate graph
+
+    # When buffering writes, how much to let pile up before dodging to write
+    # them out:
+    MAX_PENDING_BYTES = 64 * 1024
+    MAX_PENDING_LINES = 500
+    MAX_PENDING_SECONDS = 0.1
+
+    def __init__(self, max_value, term, filled_color=8, empty_color=7,
+                 max_fps=0, buffer_writes=False, status_width=0):
+        """``max_value`` is the highest value I will attain. Must be >0.
+
+        It may also be None if it isn't known yet, in which case I show an
+        indeterminate graph until somebody sets my ``max``.
+
+        ``max_fps`` is the most times per second I will repaint in response to
+        ``update()``. Updates that come in faster are remembered and painted
+        once the interval is up. 0 means no limit.
 
-    def __init__(self, max_value, term, filled_color=8, empty_color=7):
-        """``max_value`` is the highest value I will attain. Must be >0."""
+        If ``buffer_writes`` is True, output passed to ``write()`` is saved up
+        and written in bursts, dodging once per burst rather than once per
+        write.
+
+        ``status_width`` is how many columns to set aside, between the test
+        path and the graph, for the ``status`` passed to ``update()``: a rate
+        or an ETA, say.
+
+        """
         self.stream = term.stream
         self.max = max_value
         self._term = term
         self.last = ''  # The contents of the previous progress line printed
+        # The (padded test path, padded status, graph key) actually on the
+        # screen, or None if the line is blank:
+        self._painted = None
         self._measure_terminal()
 
+        # The latest state we've been told about, which may not be painted yet:
+        self._test_path, self._number, self._status = '', 0, ''
+        self.status_width = status_width
+        self._is_stale = False
+        self._min_interval = 1.0 / max_fps if max_fps else 0
+        # The clock is monotonic where it can be, so it may start near 0:
+        self._last_paint_time = float('-inf')
+        self._catch_up_timer = None
+        # Serializes painting, since the catch-up timer paints from another
+        # thread:
+        self._lock = RLock()
+
+        # (stream, data) pairs waiting to be written, in order:
+        self._buffer_writes = buffer_writes
+        self._pending = []
+        self._pending_bytes = self._pending_lines = 0
+        self._flush_timer = None
+
         # Prepare formatting, dependent on whether we have terminal colors:
         if term.number_of_colors > max(filled_color, empty_color):
             self._fill_cap = term.on_color(filled_color)
@@ -26,6 +76,8 @@ class ProgressBar(object):
             self._fill_cap = term.reverse
             self._empty_cap = lambda s: s
             self._empty_char = '_'
+        self._bold, self._normal = term.bold, term.normal
+        self._prepare_graphs()
 
         signal(SIGWINCH, self._handle_winch)
 
@@ -36,50 +88,229 @@ class ProgressBar(object):
     def _handle_winch(self, *args):
         #self.erase()  # Doesn't seem to help.
         self._measure_terminal()
+        self._painted = None  # Everything has moved, so repaint it all.
         # TODO: Reprint the bar but at the new width.
 
-    def update(self, test_path, number):
-        """Draw an updated progress bar.
-
-        At the moment, the graph takes a fixed width, and the test identifier
-        takes the rest of the row, truncated from the left to fit.
+    def update(self, test_path, number, status=''):
+        """Draw an updated progress bar, or arrange for it to be drawn soon if
+        we've painted too recently.
 
         test_path -- the selector of the test being run
         number -- how many tests have been run so far, including this one
+        status -- text for the status area, if we have one
+
+        """
+        with self._lock:
+            self._test_path, self._number, self._status = (test_path, number,
+                                                           status)
+            if self._pending:
+                # A test boundary is a good time to get output out of the
+                # way. Erasing writes it, and then we paint the new state.
+                self.erase()
+                self._paint()
+                return
+            if self._min_interval:
+                wait = self._last_paint_time + self._min_interval - clock()
+                if wait > 0:
+                    self._is_stale = True
+                    if self._catch_up_timer is None:
+                        self._catch_up_timer = Timer(wait, self._catch_up)
+                        self._catch_up_timer.daemon = True
+                        self._catch_up_timer.start()
+                    return
+            self._paint()
+
+    def _catch_up(self):
+        """Paint the latest state if nobody has gotten around to it.
+
+        This makes sure the bar never sits showing an old test just because
+        the current one started too soon after its predecessor.
 
         """
+        with self._lock:
+            self._catch_up_timer = None
+            if self._is_stale and not self._is_dodging:
+                self._paint()
+
+    def _paint(self):
+        """Render the latest state, and write out whatever differs from what's
+        already on the screen.
+
+        At the moment, the graph and the status area take fixed widths, and
+        the test identifier takes the rest of the row, truncated from the left
+        to fit.
+
+        """
+        test_path, number = self._test_path, self._number
+        status_width = self.status_width
+        width = self.GRAPH_WIDTH
+
         # TODO: Play nicely with absurdly narrow terminals. (OS X's won't even
         # go small enough to hurt us.)
 
-        # Figure out graph:
-        GRAPH_WIDTH = 14
-        # min() is in case we somehow get the total test count wrong. It's tricky.
-        num_filled = int(round(min(1.0, float(number) / self.max) * GRAPH_WIDTH))
-        graph = ''.join([self._fill_cap(' ' * num_filled),
-                         self._empty_cap(self._empty_char * (GRAPH_WIDTH - num_filled))])
+        # Figure out graph. A non-negative key is the number of filled cells;
+        # a negative one is the (inverted) offset of the indeterminate block.
+        if self.max is None:
+            graph_key = -1 - number % (width - self.BLOCK_WIDTH + 1)
+        else:
+            # min() is in case we somehow get the total test count wrong.
+            # It's tricky.
+            graph_key = int(round(min(1.0, float(number) / self.max) * width))
+        graph = self._graphs[graph_key]
 
         # Figure out the test identifier portion:
-        cols_for_path = self.cols - GRAPH_WIDTH - 2  # 2 spaces between path & graph
+        cols_for_path = self.cols - width - 2  # 2 spaces between path & graph
+        if status_width:
+            cols_for_path -= status_width + 2
         if len(test_path) > cols_for_path:
             test_path = test_path[len(test_path) - cols_for_path:]
         else:
             test_path += ' ' * (cols_for_path - len(test_path))
+        status = self._status[:status_width]
+        status += ' ' * (status_width - len(status))
+        status_column = cols_for_path + 2
+        graph_column = status_column + (status_width + 2 if status_width
+                                        else 0)
 
         # Put them together, and let simmer:
-        self.last = self._term.bold(test_path) + '  ' + graph
-        with self._at_last_line():
-            self.stream.write(self.last)
+        self.last = (self._bold + test_path + self._normal + '  ' +
+                     (status + '  ' if status_width else '') + graph)
+        self._is_stale = False
+        self._last_paint_time = clock()
+
+        if (self._painted is None or
+            len(self._painted[0]) != len(test_path) or
+            len(self._painted[1]) != len(status)):
+            # There's nothing (of ours) on the line, or the terminal or the
+            # status area has changed size since we painted it, so paint all
+            # of it.
+            with self._at_last_line():
+                self.stream.write(self.last)
+        else:
+            old_path, old_status, old_graph_key = self._painted
+            if old_path != test_path:
+                # Most consecutive tests share a module path, and the padding
+                # at the end rarely moves, so write only the middle:
+                start, end = _differing_span(old_path, test_path)
+                chunk = self._bold + test_path[start:end] + self._normal
+                if (old_graph_key != graph_key and end == cols_for_path and
+                    not status_width):
+                    # We're already over here; may as well keep going.
+                    chunk += '  ' + graph
+                    old_graph_key = graph_key
+                with self._at_last_line(start):
+                    self.stream.write(chunk)
+            if old_status != status:
+                start, end = _differing_span(old_status, status)
+                with self._at_last_line(status_column + start):
+                    self.stream.write(status[start:end])
+            if old_graph_key != graph_key:
+                if old_graph_key >= 0 and graph_key >= 0:
+                    # Just fill or empty the cells between the two levels.
+                    low, high = sorted([old_graph_key, graph_key])
+                    caps = self._fills if graph_key > old_graph_key else self._empties
+                    with self._at_last_line(graph_column + low):
+                        self.stream.write(caps[high - low])
+                else:
+                    with self._at_last_line(graph_column):
+                        self.stream.write(graph)
+        self._painted = test_path, status, graph_key
         self.stream.flush()
 
+    def _prepare_graphs(self):
+        """Precompute the formatted graph for every level of fullness, as well
+        as for every position of the indeterminate block.
+
+        Put them in ``self._graphs``, indexed as described in ``_paint()``.
+        Also keep runs of filled and empty cells of every length around in
+        ``self._fills`` and ``self._empties`` for partial repaints.
+
+        """
+        width, block = self.GRAPH_WIDTH, self.BLOCK_WIDTH
+        self._fills = [self._fill_cap(' ' * n) for n in range(width + 1)]
+        self._empties = [self._empty_cap(self._empty_char * n)
+                         for n in range(width + 1)]
+        graphs = dict((n, self._fills[n] + self._empties[width - n])
+                      for n in range(width + 1))
+        # An indeterminate graph has a little block that moves along one cell
+        # per test, for when we don't know how many tests there are:
+        for offset in range(width - block + 1):
+            graphs[-1 - offset] = ''.join([
+                self._empties[offset],
+                self._fills[block],
+                self._empties[width - block - offset]])
+        self._graphs = graphs
+
+    def write(self, stream, data):
+        """Write ``data`` to ``stream`` without smearing the bar.
+
+        If we're buffering, save it up, and write it along with its fellows
+        when enough has piled up, enough time has passed, or somebody else
+        needs the bar out of the way.
+
+        """
+        with self._lock:
+            if not self._buffer_writes or self._is_dodging:
+                # If we're already out of the way, there's nothing to save.
+                with self.dodging():
+                    stream.write(data)
+                return
+
+            self._pending.append((stream, data))
+            self._pending_bytes += len(data)
+            self._pending_lines += data.count('\n')
+            if (self._pending_bytes >= self.MAX_PENDING_BYTES or
+                self._pending_lines >= self.MAX_PENDING_LINES):
+                self.flush_writes()
+            elif self._flush_timer is None:
+                self._flush_timer = Timer(self.MAX_PENDING_SECONDS,
+                                          self.flush_writes)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush_writes(self):
+        """Write out any buffered output, dodging just once for all of it."""
+        with self._lock:
+            if self._pending and not self._is_dodging:
+                with self.dodging():  # erase() does the writing.
+                    pass
+
+    def _write_pending(self):
+        """Write out buffered output, in order. The bar had better be out of
+        the way."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        pending, self._pending = self._pending, []
+        self._pending_bytes = self._pending_lines = 0
+        streams = []
+        for stream, data in pending:
+            stream.write(data)
+            if stream not in streams:
+                streams.append(stream)
+        for stream in streams:
+            stream.flush()
+
     def erase(self):
-        """White out the progress bar."""
-        with self._at_last_line():
-            self.stream.write(self._term.clear_eol)
-        self.stream.flush()
+        """White out the progress bar, and then write out any buffered output
+        so it lands before whatever the caller is about to write."""
+        with self._lock:
+            # Whoever erased us will either repaint us from the latest state
+            # or wants us gone, so the timer has nothing left to do.
+            self._is_stale = False
+            self._painted = None
+            if self._catch_up_timer is not None:
+                self._catch_up_timer.cancel()
+                self._catch_up_timer = None
+            with self._at_last_line():
+                self.stream.write(self._term.clear_eol)
+            self.stream.flush()
+            if self._pending:
+                self._write_pending()
 
-    def _at_last_line(self):
+    def _at_last_line(self, column=0):
         """Return a context manager that positions the cursor at the last line, lets you write things, and then returns it to its previous position."""
-        return self._term.location(0, self.lines)
+        return self._term.location(column, self.lines)
 
     def dodging(bar):
         """Return a context manager which erases the bar, lets you output things, and then redraws the bar.
@@ -92,6 +323,8 @@ class ProgressBar(object):
 
             def __enter__(self):
                 """Erase the progress bar so bits of disembodied progress bar don't get scrolled up the terminal."""
+                # Keep the catch-up timer from painting while we're away.
+                bar._lock.acquire()
                 # My terminal has no status line, so we make one manually.
                 bar._is_dodging += 1  # Increment before calling erase(), which
                                       # calls dodging() again.
@@ -104,15 +337,28 @@ class ProgressBar(object):
                                           # read it.
                     # This is really necessary only because we monkeypatch
                     # stderr; the next test is about to start and will redraw
-                    # the bar.
-                    with bar._at_last_line():
-                        bar.stream.write(bar.last)
-                    bar.stream.flush()
+                    # the bar. Paint the latest state, in case an update came
+                    # in faster than the frame rate allowed.
+                    if bar.last:  # Don't paint a bar that was never shown.
+                        bar._paint()
                 bar._is_dodging -= 1
+                bar._lock.release()
 
         return ShyProgressBar()
 
 
+def _differing_span(old, new):
+    """Return the (start, end) of the slice of ``new`` that differs from
+    ``old``, which had better be the same length."""
+    start = 0
+    end = length = len(new)
+    while start < length and old[start] == new[start]:
+        start += 1
+    while end > start and old[end - 1] == new[end - 1]:
+        end -= 1
+    return start, end
+
+
 class Null(object):
     def __getattr__(self, *args, **kwargs):
         """Return a boring callable for any attribute accessed."""
@@ -130,5 +376,10 @@ class NullProgressBar(Null):
     Comes in handy when you want to have an option to hide the progress bar.
 
     """
+    max = None
+
     def dodging(self):
         return Null()  # So Python can call __enter__ and __exit__ on it
+
+    def write(self, stream, data):
+        stream.write(data)
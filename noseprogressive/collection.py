@@ -0,0 +1,197 @@
+"""Facilities for collecting and counting tests"""
+
+from os import stat
+from os.path import isfile
+from unittest import TestSuite
+
+from nose.case import Test
+from nose.suite import LazySuite
+
+from noseprogressive.utils import load_json, nose_selector, save_json
+
+
+__all__ = ['materialize', 'reorder', 'run_selector', 'CollectionManifest',
+           'CountedSuite']
+
+
+def materialize(suite):
+    """Expand every lazy suite within ``suite`` in place, and return ``suite``.
+
+    nose's LazySuites pull their tests from generators, so iterating over one
+    (to count it, say) uses it up. Once materialized, a suite can be iterated
+    over as many times as you like, so we can count it and then hand the very
+    same object to the runner.
+
+    """
+    if isinstance(suite, LazySuite) and suite.test_generator is not None:
+        # _precache may already hold a test peeked at by __nonzero__.
+        suite._precache.extend(suite.test_generator)
+        suite.test_generator = None
+    for child in _children(suite):
+        materialize(child)
+    return suite
+
+
+def _children(suite):
+    """Return the list of a materialized suite's tests, which you may change
+    in place, or an empty list if it's a test case."""
+    if isinstance(suite, LazySuite):
+        return suite._precache
+    if isinstance(suite, TestSuite):
+        return suite._tests
+    return []
+
+
+def run_selector(test):
+    """Return the selector a test case from a materialized suite will have
+    when it runs.
+
+    Materialized suites hold bare test cases, which nose wraps in a ``Test``
+    only to run them. Without the wrapper, a generated test's selector lacks
+    its arguments, so it wouldn't match what the history knows it by.
+
+    """
+    if not isinstance(test, Test):
+        test = Test(test)  # A throwaway; nose makes its own to run it.
+    return nose_selector(test)
+
+
+def reorder(suite, outcome, failed_first=False, duration_order=None):
+    """Sort the tests within each suite of a materialized ``suite``, in place.
+
+    Tests move only among their siblings, so everything sharing a module or
+    class fixture still runs together. A suite sorts as if it were a single
+    test which failed if any of its tests did and took as long as all of them
+    together. Ties keep their original order.
+
+    :arg outcome: A callable which returns (duration, failed) from the last
+        run of a test case, or None if there was none
+    :arg failed_first: Whether to run tests that failed last time first
+    :arg duration_order: "shortest" or "longest" to run the shortest or the
+        longest tests first, otherwise None
+
+    Return the (duration, failed) of the whole suite.
+
+    """
+    children = _children(suite)
+    if not children and not isinstance(suite, TestSuite):
+        return outcome(suite) or (0.0, False)
+
+    outcomes = [reorder(child, outcome, failed_first, duration_order)
+                for child in children]
+
+    def key(pair):
+        duration, failed = pair[0]
+        return ((not failed) if failed_first else False,
+                {'shortest': duration, 'longest': -duration}.get(
+                    duration_order, 0))
+    sorted_pairs = sorted(zip(outcomes, children), key=key)
+    children[:] = [child for _, child in sorted_pairs]
+    return (sum(duration for duration, _ in outcomes),
+            any(failed for _, failed in outcomes))
+
+
+class CountedSuite(TestSuite):
+    """A stand-in for a suite whose number of tests we already know
+
+    It contains no tests; it's good only for counting.
+
+    """
+    def __init__(self, count):
+        super(CountedSuite, self).__init__()
+        self._count = count
+
+    def countTestCases(self):
+        return self._count
+
+
+class CollectionManifest(object):
+    """A record, kept on disk between runs, of how many tests each file holds
+
+    Entries are keyed by path and remember the mtime and size the file had
+    when we counted it, so a changed file is simply counted afresh. Entries
+    for files that have gone away are dropped when saving. The whole manifest
+    is thrown out if the test-selection options change, since those change
+    the counts as well.
+
+    """
+    VERSION = 1
+
+    def __init__(self, path, selection=''):
+        """Load the manifest at ``path``, if there is a usable one.
+
+        :arg selection: A string summarizing the options that affect which
+            tests get collected
+
+        """
+        self.path = path
+        self.selection = selection
+        self._files = {}
+        self._dirty = False
+        data = load_json(path)
+        if (isinstance(data, dict) and
+            data.get('version') == self.VERSION and
+            data.get('selection') == selection):
+            self._files = data.get('files', {})
+
+    def count(self, filename):
+        """Return the remembered number of tests in a file, None if unknown."""
+        entry = self._files.get(filename)
+        if entry is None:
+            return None
+        mtime, size, count = entry
+        try:
+            info = stat(filename)
+        except OSError:
+            return None
+        if info.st_mtime == mtime and info.st_size == size:
+            return count
+        return None
+
+    def remember(self, filename, count):
+        """Note that ``filename``, as it currently stands, has ``count`` tests."""
+        try:
+            info = stat(filename)
+        except OSError:
+            return
+        self._files[filename] = [info.st_mtime, info.st_size, count]
+        self._dirty = True
+
+    def save(self):
+        """Write the manifest back to disk if anything changed, leaving out
+        files that no longer exist, so renames and deletions don't pile up.
+
+        Failing to write is not worth interrupting a test run over; we'll just
+        count again next time.
+
+        """
+        for filename in [f for f in self._files if not isfile(f)]:
+            del self._files[filename]
+            self._dirty = True
+        if self._dirty and save_json(self.path,
+                                     {'version': self.VERSION,
+                                      'selection': self.selection,
+                                      'files': self._files}):
+            self._dirty = False
+
+    def counting_loader(self, orig_method):
+        """Return a replacement for a loader's ``loadTestsFromName()`` for use
+        while counting.
+
+        Discovered test modules we have fresh counts for are not imported at
+        all; we return a ``CountedSuite`` in their stead. The rest are loaded
+        and counted normally, and their counts remembered.
+
+        """
+        def load_or_count(name, module=None, discovered=False):
+            if (not discovered or module is not None or
+                not name.endswith('.py') or not isfile(name)):
+                return orig_method(name, module=module, discovered=discovered)
+            count = self.count(name)
+            if count is None:
+                count = orig_method(name,
+                                    module=module,
+                                    discovered=discovered).countTestCases()
+                self.remember(name, count)
+            return CountedSuite(count)
+        return load_or_count
@@ -0,0 +1,110 @@
+"""A machine-readable log of what happens during a run"""
+
+from __future__ import with_statement
+import json
+from os import fdopen
+from threading import Lock, Timer
+
+
+__all__ = ['EventLog', 'Listeners']
+
+
+class EventLog(object):
+    """A stream of JSON objects, one per line, one per event
+
+    Each test gets a ``start`` event and then one named for how it came out:
+    ``pass``, ``fail``, ``error``, or the label of an error class, like
+    ``skip``. A ``summary`` event comes last. Nothing is kept around but a
+    batch of lines waiting to be written, which goes out once it's
+    ``BATCH_LINES`` long or, by timer, ``MAX_DELAY`` seconds old, so
+    dashboards can tail the file while the tests run, and see which test is
+    hanging if one is.
+
+    """
+    BATCH_LINES = 100
+    MAX_DELAY = 0.5
+
+    def __init__(self, file):
+        self._file = file
+        self._batch = []
+        self._flush_timer = None  # started when the batch gets its first line
+        # The timer flushes from a thread of its own:
+        self._lock = Lock()
+
+    @classmethod
+    def open(cls, destination):
+        """Return an ``EventLog`` writing to ``destination``: a path, or an
+        already open file descriptor, given as a string of digits."""
+        if destination.isdigit():
+            return cls(fdopen(int(destination), 'w'))
+        return cls(open(destination, 'w'))
+
+    def write(self, **event):
+        line = json.dumps(event) + '\n'
+        with self._lock:
+            self._batch.append(line)
+            if len(self._batch) >= self.BATCH_LINES:
+                self._flush()
+            elif self._flush_timer is None:
+                self._flush_timer = Timer(self.MAX_DELAY, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._flush()
+
+    def _flush(self):
+        """Write out the batch. Call only while holding ``_lock``."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._batch:
+            self._file.write(''.join(self._batch))
+            self._batch = []
+        self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+    def test_started(self, selector):
+        self.write(event='start', test=selector)
+
+    def test_finished(self, selector, duration, outcome):
+        """Log how a test came out.
+
+        :arg outcome: A dict with at least an ``event`` key, naming the
+            outcome, and perhaps details like ``exception``
+
+        """
+        self.write(test=selector, duration=duration, **outcome)
+
+
+class Listeners(object):
+    """Several things with ``EventLog``'s interface, acting as one"""
+
+    def __init__(self, listeners):
+        self._listeners = listeners
+
+    def write(self, **event):
+        for listener in self._listeners:
+            listener.write(**event)
+
+    def flush(self):
+        for listener in self._listeners:
+            listener.flush()
+
+    def close(self):
+        for listener in self._listeners:
+            listener.close()
+
+    def test_started(self, selector):
+        for listener in self._listeners:
+            listener.test_started(selector)
+
+    def test_finished(self, selector, duration, outcome):
+        for listener in self._listeners:
+            listener.test_finished(selector, duration, outcome)
@@ -0,0 +1,217 @@
+"""Things we remember about tests from one run to the next"""
+
+from __future__ import with_statement
+from errno import EEXIST
+from os import makedirs
+from os.path import dirname
+try:
+    import sqlite3
+except ImportError:  # Some Pythons are built without it.
+    sqlite3 = None
+
+from noseprogressive.timing import clock
+
+
+__all__ = ['RunHistory', 'Estimator']
+
+
+# Trouble with the database, which we carry on without:
+_DATABASE_ERRORS = (OSError,) if sqlite3 is None else (sqlite3.Error, OSError)
+
+
+class RunHistory(object):
+    """A record, kept in an SQLite database between runs, of how long each
+    test took and whether it failed
+
+    Besides each test's latest outcome, it remembers, for each combination of
+    test-selection options and names, how many tests the last complete run had
+    and how long they took in all. That's what lets us tell how much of a
+    suite is left without knowing in advance which tests are in it.
+
+    The database is read the first time somebody asks about a test and written
+    only by ``save()``. Trouble with it is never worth interrupting a test run
+    over; we just carry on without history. That goes for a Python without
+    the ``sqlite3`` module, too.
+
+    """
+    VERSION = 1
+    MAX_SUITES = 100  # Past this, forget them all and start over.
+
+    def __init__(self, path, suite=''):
+        """
+        :arg suite: A string identifying the set of tests being run, as
+            determined by the selection options and the names on the command
+            line
+
+        """
+        self.path = path
+        self.suite = suite
+        self._tests = None  # selector -> (duration, failed), once loaded
+        self._suite_total = None  # (count, total duration), once loaded
+        self._run = {}  # The same as _tests, but from this run
+
+    def _connect(self):
+        """Return a connection to the database, creating it if need be."""
+        if sqlite3 is None:
+            raise OSError('This Python has no sqlite3 module.')
+        try:
+            makedirs(dirname(self.path))
+        except OSError as exc:
+            if exc.errno != EEXIST:
+                raise
+        connection = sqlite3.connect(self.path)
+        if connection.execute('PRAGMA user_version').fetchone()[0] != \
+                self.VERSION:
+            connection.executescript("""
+                DROP TABLE IF EXISTS tests;
+                DROP TABLE IF EXISTS suites;
+                CREATE TABLE tests (selector TEXT PRIMARY KEY,
+                                    duration REAL,
+                                    failed INTEGER);
+                CREATE TABLE suites (suite TEXT PRIMARY KEY,
+                                     count INTEGER,
+                                     duration REAL);
+                PRAGMA user_version = %d;""" % self.VERSION)
+        return connection
+
+    def _load(self):
+        self._tests = {}
+        try:
+            connection = self._connect()
+            try:
+                for selector, duration, failed in connection.execute(
+                        'SELECT selector, duration, failed FROM tests'):
+                    self._tests[selector] = duration, bool(failed)
+                self._suite_total = connection.execute(
+                    'SELECT count, duration FROM suites WHERE suite=?',
+                    (self.suite,)).fetchone()
+            finally:
+                connection.close()
+        except _DATABASE_ERRORS:
+            pass
+
+    def outcome(self, selector):
+        """Return (duration, failed) from a test's last run, None if we've
+        never seen it."""
+        if self._tests is None:
+            self._load()
+        return self._tests.get(selector)
+
+    def duration(self, selector):
+        """Return how long a test took last time, None if we don't know."""
+        outcome = self.outcome(selector)
+        return None if outcome is None else outcome[0]
+
+    def expected_total(self, count):
+        """Return how long the whole suite took last time, or None if we
+        don't know or it had a different number of tests than ``count``."""
+        if self._tests is None:
+            self._load()
+        if self._suite_total is not None and self._suite_total[0] == count:
+            return self._suite_total[1]
+        return None
+
+    def record(self, selector, duration, failed=False):
+        """Note how long a test took this run and whether it failed."""
+        self._run[selector] = duration, failed
+
+    def save(self, complete_count=None):
+        """Write this run's outcomes to the database.
+
+        :arg complete_count: The number of tests in the suite, if they all
+            ran, so we can remember the suite's total duration
+
+        """
+        if not self._run:
+            return
+        try:
+            connection = self._connect()
+            try:
+                with connection:  # a transaction
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO tests VALUES (?, ?, ?)',
+                        ((selector, duration, int(failed)) for
+                         selector, (duration, failed) in self._run.items()))
+                    if complete_count:
+                        if connection.execute(
+                                'SELECT count(*) FROM suites'
+                                ).fetchone()[0] >= self.MAX_SUITES:
+                            connection.execute('DELETE FROM suites')
+                        connection.execute(
+                            'INSERT OR REPLACE INTO suites VALUES (?, ?, ?)',
+                            (self.suite,
+                             complete_count,
+                             sum(d for d, f in self._run.values())))
+            finally:
+                connection.close()
+        except _DATABASE_ERRORS:
+            return
+        self._run = {}
+
+
+class Estimator(object):
+    """Predictor of how much longer a run will take
+
+    If a ``RunHistory`` knows how long the whole suite took last time,
+    the estimate is that, less the historical durations of the tests done so
+    far, scaled by how fast we're going compared to last time. Otherwise, it
+    assumes the remaining tests will take as long on average as the ones so
+    far.
+
+    """
+    def __init__(self, history=None):
+        self._history = history
+        self._start = clock()
+        self._done = 0
+        self._done_expected = 0.0  # Historical durations of the tests done
+
+    def test_finished(self, selector, duration):
+        """Note that a test finished."""
+        self._done += 1
+        if self._history is not None:
+            expected = self._history.duration(selector)
+            if expected is not None:
+                self._done_expected += expected
+
+    def rate(self):
+        """Return the tests finished per second so far."""
+        elapsed = clock() - self._start
+        return self._done / elapsed if elapsed > 0 else 0.0
+
+    def remaining(self, total):
+        """Return the seconds likely left in a run of ``total`` tests, or
+        None if there's no telling yet."""
+        if not total:
+            return None
+        elapsed = clock() - self._start
+        expected_total = (self._history.expected_total(total)
+                          if self._history is not None else None)
+        if expected_total is not None:
+            left = max(0.0, expected_total - self._done_expected)
+            if self._done_expected > 0 and expected_total > 0:
+                # Lean on the speed so far only once it's seen enough to go
+                # by: fully at a tenth of the way through.
+                weight = min(1.0, 10 * self._done_expected / expected_total)
+                left *= 1 + weight * (elapsed / self._done_expected - 1)
+            return left
+        if not self._done:
+            return None
+        return elapsed / self._done * max(0, total - self._done)
+
+    def status(self, total):
+        """Return a short summary of the rate and the ETA, for the bar."""
+        rate = self.rate()
+        status = ('%.1f/s' if rate < 10 else '%d/s') % rate
+        remaining = self.remaining(total)
+        if remaining is not None:
+            status += '  ETA ' + _format_duration(remaining)
+        return status
+
+
+def _format_duration(seconds):
+    """Return a duration in seconds like 1:02:03 or 2:03."""
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '%d:%02d:%02d' % (hours, minutes, seconds)
+    return '%d:%02d' % (minutes, seconds)
@@ -0,0 +1,131 @@
+"""A JUnit-style XML report written as the tests run"""
+
+import re
+import sys
+from xml.sax.saxutils import escape, quoteattr
+
+from noseprogressive.utils import as_unicode
+
+
+__all__ = ['JUnitReport']
+
+
+# Characters XML 1.0 can't hold at all, even escaped. Narrow builds of Python
+# 2 hold characters beyond the BMP as surrogate pairs, so only lone
+# surrogates go there; elsewhere, every surrogate is lone.
+if sys.maxunicode == 0xffff:
+    _SURROGATES = (u'[\ud800-\udbff](?![\udc00-\udfff])|'
+                   u'(?<![\ud800-\udbff])[\udc00-\udfff]')
+else:
+    _SURROGATES = u'[\ud800-\udfff]'
+_ILLEGAL_XML = re.compile(
+    u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]|' + _SURROGATES)
+
+
+def _text(s):
+    """Return ``s`` as unicode fit for an XML document."""
+    return _ILLEGAL_XML.sub(u'?', as_unicode(s))
+
+
+def _split_selector(selector):
+    """Return a (classname, name) pair for a nose selector like
+    ``pkg.mod:Class.test_thing``."""
+    module, _, rest = selector.partition(':')
+    # Generator tests' arguments can have dots in them:
+    callable, paren, args = rest.partition('(')
+    if '.' in callable:
+        cls, callable = callable.rsplit('.', 1)
+        module = '%s.%s' % (module, cls)
+    return module, callable + paren + args
+
+
+class JUnitReport(object):
+    """A JUnit XML file, one ``<testcase>`` element per test, written out as
+    each test finishes
+
+    Nothing is held in memory but the running totals. The ``<testsuite>``
+    element's attributes need those totals, though, so we start the file with
+    a placeholder wide enough for them and write them over it once the run is
+    over. Whitespace pads out the rest; XML doesn't mind it inside a tag.
+
+    Listens for the same things an ``EventLog`` does.
+
+    """
+    HEADER_WIDTH = 160  # bytes set aside for the <testsuite> start tag
+
+    def __init__(self, file):
+        """
+        :arg file: A seekable file open for binary writing
+
+        """
+        self._file = file
+        self.tests = self.failures = self.errors = self.skipped = 0
+        self.time = 0.0
+        file.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        self._header_offset = file.tell()
+        file.write(self._header())
+
+    @classmethod
+    def open(cls, path):
+        return cls(open(path, 'wb'))
+
+    def _header(self):
+        header = ('<testsuite name="nosetests" tests="%d" errors="%d" '
+                  'failures="%d" skip="%d" time="%.3f"' %
+                  (self.tests, self.errors, self.failures, self.skipped,
+                   self.time))
+        return (header.ljust(self.HEADER_WIDTH - 2) + '>\n').encode('ascii')
+
+    def test_started(self, selector):
+        pass
+
+    def test_finished(self, selector, duration, outcome):
+        """Write out a ``<testcase>`` for a test.
+
+        :arg outcome: A dict like the ``EventLog`` gets, with an ``event`` key
+            and, for failures, ``exception`` and ``traceback``
+
+        """
+        self.tests += 1
+        self.time += duration
+        classname, name = _split_selector(selector)
+        element = u'<testcase classname=%s name=%s time="%.3f"' % (
+            quoteattr(_text(classname)), quoteattr(_text(name)), duration)
+        kind = outcome['event']
+        if kind == 'pass':
+            element += u' />\n'
+        else:
+            exception = _text(outcome.get('exception', u''))
+            if kind == 'fail':
+                tag = u'failure'
+                self.failures += 1
+            elif kind == 'error' or 'traceback' in outcome:
+                # Errors and error classes that count as failures
+                tag = u'error'
+                self.errors += 1
+            else:
+                tag = u'skipped'
+                self.skipped += 1
+            element += u'>\n<%s type=%s message=%s>%s</%s>\n</testcase>\n' % (
+                tag,
+                quoteattr(exception.split(u':', 1)[0] if 'traceback' in
+                          outcome else _text(kind)),
+                quoteattr(exception),
+                escape(_text(outcome.get('traceback', u''))),
+                tag)
+        self._file.write(element.encode('utf-8'))
+
+    def write(self, **event):
+        """Ignore events other than tests'."""
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        """Finish the document, and fill in the totals."""
+        self._file.write(b'</testsuite>\n')
+        header = self._header()
+        if len(header) <= self.HEADER_WIDTH:  # It always is, in this century.
+            self._file.seek(self._header_offset)
+            self._file.write(header)
+        self._file.close()
@@ -0,0 +1,320 @@
+"""Support for nose's multiprocess plugin
+
+When tests run in worker processes, the parent's result never hears about
+them starting, so the workers tell it themselves, over a queue the runner
+hands them when it starts them.
+
+"""
+from __future__ import with_statement
+from functools import partial
+from multiprocessing import Queue
+from os import getpid
+from threading import Thread
+
+from nose.plugins.multiprocess import MultiProcessTestRunner
+
+from noseprogressive.bar import NullProgressBar
+from noseprogressive.recording import RecordingBar
+from noseprogressive.result import ProgressiveResult
+
+
+__all__ = ['ParallelProgress', 'ProgressiveMultiProcessRunner']
+
+
+class ParallelProgress(object):
+    """Gatherer of test starts from worker processes, for showing on one bar
+
+    Workers call ``test_started()`` and ``test_finished()``, as they would on
+    an ``EventLog``, and, if we're keeping a history or showing an ETA,
+    ``record()``. In the parent, a thread takes their reports off the queue,
+    updates the bar with the combined count, the ETA, and either the latest
+    test or, if ``show_workers`` is on, what each worker is running, and
+    passes them along to the ``RunHistory``, the ``Estimator``, and the
+    ``EventLog``, if any.
+
+    """
+    SEPARATOR = ' | '
+
+    def __init__(self, workers, show_workers=False, history=None,
+                 events=None):
+        self._queue = Queue()
+        self._workers = workers
+        self._show_workers = show_workers
+        self.history = history
+        self.events = events
+        self.estimator = None
+        self._started = 0
+        # [pid, selector, sequence number of its latest report] per worker:
+        self._slots = []
+        self._latest = ''
+        self._thread = None
+
+    def test_started(self, selector):
+        """Report, from a worker, that a test is starting."""
+        self._queue.put(('start', getpid(), selector))
+
+    def test_finished(self, selector, duration, outcome):
+        """Report, from a worker, how a test came out, for the event log."""
+        if self.events is not None:
+            self._queue.put(('outcome', selector, duration, outcome))
+
+    def record(self, selector, duration, failed=False):
+        """Report, from a worker, how a test went, for the history and the
+        ETA."""
+        self._queue.put(('record', selector, duration, failed))
+
+    def tests_finished(self, count):
+        """Note, from the parent, that at least ``count`` tests have run.
+
+        This keeps the bar moving even if some tests' starts were never
+        reported, say because they ran in the parent.
+
+        """
+        self._queue.put(('finished', count))
+
+    def start(self, bar, estimator=None):
+        """Start relaying reports to ``bar``, and durations to ``estimator``
+        for the bar's status, if there is one.
+
+        Call before the workers start, so they know to send durations.
+
+        """
+        self.estimator = estimator
+        self._thread = Thread(target=self._run, args=(bar,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Relay whatever's already reported, and then stop."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def __getstate__(self):
+        """Leave the parent's end of things behind when a worker that isn't
+        forked gets a copy of me.
+
+        Workers just need the queue, and to know whether anybody keeps a
+        history, an ETA, or an event log.
+
+        """
+        state = dict(self.__dict__, _thread=None, _slots=[])
+        for name in ('history', 'events', 'estimator'):
+            if state[name] is not None:
+                state[name] = True
+        return state
+
+    def _run(self, bar):
+        # A bar that shows nothing has no columns to divide among workers,
+        # and nothing to update, unless it's being recorded.
+        null = _shows_nothing(bar)
+        while True:
+            report = self._queue.get()
+            if report is None:
+                return
+            try:
+                self._relay(report, bar, null)
+            except Exception:
+                # There's nobody to tell, and one bad report shouldn't keep
+                # the rest from the history and the event log.
+                pass
+
+    def _relay(self, report, bar, null):
+        kind = report[0]
+        if kind == 'record':
+            if self.history is not None:
+                self.history.record(*report[1:])
+            if self.estimator is not None:
+                self.estimator.test_finished(*report[1:3])
+            return
+        if kind == 'outcome':
+            self.events.test_finished(*report[1:])
+            return
+        if kind == 'finished':
+            if report[1] <= self._started:
+                return
+            self._started = report[1]
+        else:
+            pid, selector = report[1:]
+            if self.events is not None:
+                self.events.test_started(selector)
+            self._started += 1
+            self._latest = selector
+            self._occupy_slot(pid, selector)
+        if isinstance(bar, NullProgressBar):
+            return
+        path = (self._status(bar) if self._show_workers and not null
+                else self._latest)
+        if self.estimator is None:
+            bar.update(path, self._started)
+        else:
+            bar.update(path, self._started, self.estimator.status(bar.max))
+
+    def _occupy_slot(self, pid, selector):
+        """Remember what ``pid`` is running, replacing the worker we've heard
+        from least recently if it's new and there's no room."""
+        for slot in self._slots:
+            if slot[0] == pid:
+                break
+        else:
+            if len(self._slots) < self._workers:
+                slot = [pid, '', 0]
+                self._slots.append(slot)
+            else:
+                slot = min(self._slots, key=lambda s: s[2])
+                slot[0] = pid
+        slot[1:] = [selector, self._started]
+
+    def _status(self, bar):
+        """Return the text to show in the bar's test-path portion."""
+        if not self._show_workers:
+            return self._latest
+        cols = bar.cols - bar.GRAPH_WIDTH - 2
+        if bar.status_width:
+            cols -= bar.status_width + 2
+        width = max(1, (cols - len(self.SEPARATOR) * (self._workers - 1)) //
+                       self._workers)
+        statuses = []
+        for pid, selector, _ in self._slots:
+            if len(selector) > width:
+                selector = selector[len(selector) - width:]
+            statuses.append(selector + ' ' * (width - len(selector)))
+        return self.SEPARATOR.join(statuses)
+
+
+def _shows_nothing(bar):
+    """Return whether ``bar`` is a ``NullProgressBar``, recorded or not."""
+    if isinstance(bar, RecordingBar):
+        bar = bar._bar
+    return isinstance(bar, NullProgressBar)
+
+
+class WorkerResult(ProgressiveResult):
+    """The result a worker process uses for each batch of tests
+
+    It prints headlines and tracebacks into the buffer nose sends back to the
+    parent, shows no bar of its own, and reports each test's start and, if
+    the parent keeps a history, outcome to the parent's ``ParallelProgress``.
+
+    """
+    def __init__(self, cwd, progress, stream, descriptions, verbosity,
+                 config=None):
+        # The progress object stands in for the history, the estimator, and
+        # the event log, passing things along to the real ones.
+        super(WorkerResult, self).__init__(
+            cwd, None, stream, config=config,
+            history=(progress if progress.history or progress.estimator
+                     else None),
+            events=progress)
+        self._estimator = None  # No bar to show an ETA on
+
+    def _makeBar(self, total_tests):
+        return NullProgressBar()
+
+
+class _WorkerResultMaker(object):
+    """A stand-in for a result, to pass to nose's ``startProcess()``
+
+    That sends the worker the class of the result it's given, and the worker
+    calls it with just a stream and nose's config. Claiming a ``WorkerResult``
+    factory, with the run's cwd and progress filled in, as my class gets those
+    to the worker too, by pickling if it isn't forked.
+
+    """
+    def __init__(self, cwd, progress):
+        self._factory = partial(WorkerResult, cwd, progress)
+
+    @property
+    def __class__(self):
+        return self._factory
+
+
+class ProgressiveMultiProcessRunner(MultiProcessTestRunner):
+    """A version of nose's multiprocess runner that keeps one progress bar
+    current across all the workers"""
+
+    def __init__(self, cwd, totalTests, stream, history=None, events=None,
+                 recording=None, **kwargs):
+        super(ProgressiveMultiProcessRunner, self).__init__(stream=stream,
+                                                            **kwargs)
+        self._cwd = cwd
+        self._totalTests = totalTests
+        self._events = events
+        self._recording = recording
+        self._progress = ParallelProgress(
+            self.config.multiprocess_workers,
+            self.config.options.worker_status,
+            history,
+            events)
+        self._workerResultMaker = _WorkerResultMaker(cwd, self._progress)
+
+    def _makeResult(self):
+        result = ProgressiveMultiProcessResult(self._progress,
+                                               self._cwd,
+                                               self._totalTests,
+                                               self.stream,
+                                               config=self.config,
+                                               history=self._progress.history,
+                                               events=self._events,
+                                               recording=self._recording)
+        # Have the workers style their output the way we would have:
+        self.config.options.with_styling = result._term.does_styling
+        self._progress.start(result.bar, result._estimator)
+        self._result = result
+        return result
+
+    def run(self, test):
+        self._result = None
+        try:
+            return super(ProgressiveMultiProcessRunner, self).run(test)
+        finally:
+            if self._result is not None:
+                self._result.close()
+
+    def startProcess(self, iworker, testQueue, resultQueue, shouldStop,
+                     result):
+        """Start a worker which makes ``WorkerResult``s.
+
+        The superclass looks only at the class of ``result``, so a stand-in
+        will do.
+
+        """
+        return super(ProgressiveMultiProcessRunner, self).startProcess(
+            iworker, testQueue, resultQueue, shouldStop,
+            self._workerResultMaker)
+
+    def consolidate(self, result, batch_result):
+        """Fold a worker's results into ours, keeping the headlines and
+        tracebacks it printed from smearing the bar."""
+        try:
+            quiet = not batch_result[0]
+        except (TypeError, IndexError):
+            quiet = False  # Let the superclass complain about it.
+        if quiet:
+            super(ProgressiveMultiProcessRunner, self).consolidate(
+                result, batch_result)
+        else:
+            with result.bar.dodging():
+                super(ProgressiveMultiProcessRunner, self).consolidate(
+                    result, batch_result)
+        self._progress.tests_finished(result.testsRun)
+
+
+class ProgressiveMultiProcessResult(ProgressiveResult):
+    """The parent's result in a multiprocess run
+
+    Failures were printed as they came in from the workers, so, at the end,
+    it only stops relaying progress and lets other plugins report.
+
+    """
+    def __init__(self, progress, *args, **kwargs):
+        super(ProgressiveMultiProcessResult, self).__init__(*args, **kwargs)
+        self._progress = progress
+
+    def printErrors(self):
+        self._progress.stop()
+        # Nothing will update the bar now, and its catch-up timer mustn't
+        # paint it over other plugins' reports.
+        self.bar.erase()
+        self.config.plugins.report(self.stream)
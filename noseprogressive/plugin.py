@@ -1,19 +1,49 @@
 from functools import partial
 from os import getcwd
+from os.path import abspath, join
 import pdb
 import sys
+from threading import Lock, Thread
+try:
+    from unittest.runner import _WritelnDecorator  # Python 2.7+
+except ImportError:
+    from unittest import _WritelnDecorator
 from warnings import warn
 
+from nose.loader import TestLoader
 from nose.plugins import Plugin
 
+from noseprogressive.collection import (CollectionManifest, materialize,
+                                        reorder, run_selector)
+from noseprogressive.events import EventLog, Listeners
+from noseprogressive.history import RunHistory
+from noseprogressive.junit import JUnitReport
+from noseprogressive.recording import Recording
 from noseprogressive.runner import ProgressiveRunner
+from noseprogressive.timing import context_name
 from noseprogressive.tracebacks import DEFAULT_EDITOR_SHORTCUT_TEMPLATE
-from noseprogressive.wrapping import cmdloop, set_trace, StreamWrapper
+from noseprogressive.utils import path_cache, source_cache
+from noseprogressive.wrapping import (cmdloop, set_trace, OutputThread,
+                                      QueuedStream, StreamWrapper)
+
+# Plugin hooks that loading tests fires, and that change or snapshot global
+# state, like sys.path and sys.modules:
+_LOADING_HOOKS = ['beforeContext', 'afterContext',
+                  'beforeDirectory', 'afterDirectory',
+                  'beforeImport', 'afterImport']
+
 
 class ProgressivePlugin(Plugin):
     """A nose plugin which has a progress bar and formats tracebacks for humans"""
     name = 'progressive'
     _totalTests = 0
+    _countFailed = False
+    _output_thread = None
+    _loaderClass = TestLoader
+    _history = None
+    _events = None
+    _recording = None
+    _timings = None
     score = 10000  # Grab stdout and stderr before the capture plugin.
 
     def __init__(self, *args, **kwargs):
@@ -23,6 +53,10 @@ class ProgressivePlugin(Plugin):
         # wonder why capture uses them.
         self._stderr, self._stdout, self._set_trace, self._cmdloop = \
             [], [], [], []
+        # Background counts not yet finished, and a lock to keep them from
+        # stepping on each other and on prepareTestResult():
+        self._countsPending = 0
+        self._countLock = Lock()
 
     def begin(self):
         """Make some monkeypatches to dodge progress bar.
@@ -36,12 +70,16 @@ class ProgressivePlugin(Plugin):
         # instance A of the plugin, then a paired begin/finalize for each test
         # on instance B, then a final call to finalize() on instance A.
 
+        if self.conf.options.async_output and self._output_thread is None:
+            self._output_thread = OutputThread()
+
         # TODO: Do only if isatty.
         self._stderr.append(sys.stderr)
-        sys.stderr = StreamWrapper(sys.stderr, self)  # TODO: Any point?
+        sys.stderr = StreamWrapper(sys.stderr, self,  # TODO: Any point?
+                                   self._queued(sys.stderr))
 
         self._stdout.append(sys.stdout)
-        sys.stdout = StreamWrapper(sys.stdout, self)
+        sys.stdout = StreamWrapper(sys.stdout, self, self._queued(sys.stdout))
 
         self._set_trace.append(pdb.set_trace)
         pdb.set_trace = set_trace
@@ -53,13 +91,53 @@ class ProgressivePlugin(Plugin):
         # distribution dir, so save the original cwd for relativizing paths.
         self._cwd = '' if self.conf.options.absolute_paths else getcwd()
 
+        # Files may have moved or changed since any previous run in this
+        # process.
+        path_cache.clear()
+        source_cache.clear()
+
     def finalize(self, result):
-        """Put monkeypatches back as we found them."""
+        """Put monkeypatches back as we found them.
+
+        Also write out any output the bar is still buffering, wait for the
+        output thread to finish writing, if there is one, save test
+        durations, if we're keeping them, and finish off the event log, JUnit
+        report, and recording, if there are any.
+
+        """
+        if hasattr(self, 'bar'):
+            # Other plugins may have written since the summary, say while
+            # reporting. Erasing writes out what's buffered without
+            # painting the bar again, as flushing alone would.
+            self.bar.erase()
+        sys.stdout.flush()  # Through our wrappers, and the output thread
+        sys.stderr.flush()
+        if self._output_thread is not None:
+            self._output_thread.stop()
+        if self._history is not None:
+            # Remember the suite's total only if it all ran:
+            self._history.save(result.testsRun
+                               if result.testsRun == self._totalTests
+                               else None)
+        if self._events is not None:
+            self._events.close()
+            self._events = None
+        # Don't hang onto source files' contents past the run:
+        source_cache.clear()
+        if self._recording is not None:
+            self._recording.close()
+            self._recording = None
         sys.stderr = self._stderr.pop()
         sys.stdout = self._stdout.pop()
         pdb.set_trace = self._set_trace.pop()
         pdb.Pdb.cmdloop = self._cmdloop.pop()
 
+    def _queued(self, stream):
+        """Return something that writes to ``stream`` by way of the output
+        thread, or None if there isn't one."""
+        if self._output_thread is not None:
+            return QueuedStream(stream, self._output_thread)
+
     def options(self, parser, env):
         super(ProgressivePlugin, self).options(parser, env)
         parser.add_option('--progressive-editor',
@@ -134,6 +212,134 @@ class ProgressivePlugin(Plugin):
                           help="Color of the progress bar's empty portion. An "
                                 'ANSI color expressed as a number 0-15. '
                                '[NOSE_PROGRESSIVE_BAR_EMPTY_COLOR]')
+        parser.add_option('--progressive-fps',
+                          type='float',
+                          dest='max_fps',
+                          default=env.get('NOSE_PROGRESSIVE_FPS', 0),
+                          help='The most times per second to repaint the '
+                               'progress bar. Tests that start faster than '
+                               'that are skipped over. Handy over slow '
+                               'connections. 0 means no limit. '
+                               '[NOSE_PROGRESSIVE_FPS]')
+        parser.add_option('--progressive-buffer-output',
+                          action='store_true',
+                          dest='buffer_output',
+                          default=env.get('NOSE_PROGRESSIVE_BUFFER_OUTPUT',
+                                          False),
+                          help='Collect what tests write to stdout and stderr '
+                               'into bursts, moving the progress bar out of '
+                               'the way once per burst rather than once per '
+                               'write. Output may lag by up to a tenth of a '
+                               'second. [NOSE_PROGRESSIVE_BUFFER_OUTPUT]')
+        parser.add_option('--progressive-async-output',
+                          action='store_true',
+                          dest='async_output',
+                          default=env.get('NOSE_PROGRESSIVE_ASYNC_OUTPUT',
+                                          False),
+                          help='Write to the terminal from a separate thread '
+                               'so a slow or paused terminal does not hold up '
+                               'the tests. [NOSE_PROGRESSIVE_ASYNC_OUTPUT]')
+        parser.add_option('--progressive-eta',
+                          action='store_true',
+                          dest='show_eta',
+                          default=env.get('NOSE_PROGRESSIVE_ETA', False),
+                          help='Show tests per second and an estimate of the '
+                               'time left on the progress bar. Estimates are '
+                               'based on how long the tests took last time, '
+                               'if known. [NOSE_PROGRESSIVE_ETA]')
+        parser.add_option('--progressive-slowest',
+                          type='int',
+                          dest='slowest',
+                          default=env.get('NOSE_PROGRESSIVE_SLOWEST', 0),
+                          help='After the summary, list this many of the '
+                               'slowest tests and module or class fixtures. '
+                               '[NOSE_PROGRESSIVE_SLOWEST]')
+        parser.add_option('--progressive-group-failures',
+                          action='store_true',
+                          dest='group_failures',
+                          default=env.get('NOSE_PROGRESSIVE_GROUP_FAILURES',
+                                          False),
+                          help='Print the traceback of a failure only the '
+                               'first time; for later ones with the same '
+                               'exception and the same frames below the '
+                               "test's, print just the headline and which "
+                               'one it is the same as. List repeated '
+                               'failures after the summary. '
+                               '[NOSE_PROGRESSIVE_GROUP_FAILURES]')
+        parser.add_option('--progressive-storm-threshold',
+                          type='int',
+                          dest='storm_threshold',
+                          default=env.get('NOSE_PROGRESSIVE_STORM_THRESHOLD',
+                                          0),
+                          help='When more than this many tests fail within '
+                               'a second, print only their headlines, and '
+                               'write their tracebacks to a temp file, until '
+                               'the failures slow down again. '
+                               '[NOSE_PROGRESSIVE_STORM_THRESHOLD]')
+        parser.add_option('--progressive-max-records',
+                          type='int',
+                          dest='max_records',
+                          default=env.get('NOSE_PROGRESSIVE_MAX_RECORDS', 0),
+                          help='Keep at most this many errors and at most '
+                               'this many failures in memory, and write any '
+                               'more to a temp file. 0, the default, means no '
+                               'limit. [NOSE_PROGRESSIVE_MAX_RECORDS]')
+        parser.add_option('--progressive-failed-first',
+                          action='store_true',
+                          dest='failed_first',
+                          default=env.get('NOSE_PROGRESSIVE_FAILED_FIRST',
+                                          False),
+                          help='Run the tests that failed last time first, '
+                               'along with the rest of their modules and '
+                               'classes. Implies --progressive-single-pass. '
+                               '[NOSE_PROGRESSIVE_FAILED_FIRST]')
+        parser.add_option('--progressive-duration-order',
+                          type='choice',
+                          choices=['shortest', 'longest'],
+                          dest='duration_order',
+                          default=env.get('NOSE_PROGRESSIVE_DURATION_ORDER'),
+                          help='Run the "shortest" or the "longest" tests '
+                               'first, going by how long they took last time. '
+                               'Tests are moved only within their modules '
+                               'and classes, and those only within their '
+                               'packages. After --progressive-failed-first, '
+                               'if given. Implies --progressive-single-pass. '
+                               '[NOSE_PROGRESSIVE_DURATION_ORDER]')
+        parser.add_option('--progressive-events',
+                          type='string',
+                          dest='events_path',
+                          default=env.get('NOSE_PROGRESSIVE_EVENTS'),
+                          metavar='FILE',
+                          help='Write a line of JSON to FILE as each test '
+                               'starts and finishes. FILE may also be the '
+                               'number of an open file descriptor. '
+                               '[NOSE_PROGRESSIVE_EVENTS]')
+        parser.add_option('--progressive-junit',
+                          type='string',
+                          dest='junit_path',
+                          default=env.get('NOSE_PROGRESSIVE_JUNIT'),
+                          metavar='FILE',
+                          help='Write a JUnit-style XML report to FILE, a '
+                               'test at a time as the tests run. '
+                               '[NOSE_PROGRESSIVE_JUNIT]')
+        parser.add_option('--progressive-record',
+                          type='string',
+                          dest='record_path',
+                          default=env.get('NOSE_PROGRESSIVE_RECORD'),
+                          metavar='FILE',
+                          help='Record what the progress bar and the '
+                               'traceback formatter are asked to show to '
+                               'FILE, for replaying with the benchmarks. '
+                               '[NOSE_PROGRESSIVE_RECORD]')
+        parser.add_option('--progressive-source-context',
+                          type='int',
+                          dest='source_context',
+                          default=env.get('NOSE_PROGRESSIVE_SOURCE_CONTEXT',
+                                          0),
+                          metavar='LINES',
+                          help='Show this many lines of source before and '
+                               'after the line of each traceback frame. '
+                               '[NOSE_PROGRESSIVE_SOURCE_CONTEXT]')
         parser.add_option('--progressive-editor-shortcut-template',
                           type='string',
                           dest='editor_shortcut_template',
@@ -143,6 +349,56 @@ class ProgressivePlugin(Plugin):
                           help='A str.format() template for the non-code lines'
                                ' of the traceback. '
                                '[NOSE_PROGRESSIVE_EDITOR_SHORTCUT_TEMPLATE]')
+        parser.add_option('--progressive-single-pass',
+                          action='store_true',
+                          dest='single_pass',
+                          default=env.get('NOSE_PROGRESSIVE_SINGLE_PASS', False),
+                          help='Collect tests only once, counting and then '
+                               'running the very same suite, rather than '
+                               'loading everything a second time for the '
+                               'count. Test generators are expanded before '
+                               'any fixtures run. '
+                               '[NOSE_PROGRESSIVE_SINGLE_PASS]')
+        parser.add_option('--progressive-cache-dir',
+                          type='string',
+                          dest='cache_dir',
+                          default=env.get('NOSE_PROGRESSIVE_CACHE_DIR',
+                                          '.noseprogressive'),
+                          help='The directory in which to keep information '
+                               'between runs. Defaults to .noseprogressive '
+                               'in the current directory. '
+                               '[NOSE_PROGRESSIVE_CACHE_DIR]')
+        parser.add_option('--progressive-manifest',
+                          action='store_true',
+                          dest='use_manifest',
+                          default=env.get('NOSE_PROGRESSIVE_MANIFEST', False),
+                          help='Remember how many tests each file holds, and '
+                               "don't import unchanged files just to count "
+                               'them. [NOSE_PROGRESSIVE_MANIFEST]')
+        parser.add_option('--progressive-background-count',
+                          action='store_true',
+                          dest='background_count',
+                          default=env.get('NOSE_PROGRESSIVE_BACKGROUND_COUNT',
+                                          False),
+                          help='Start running tests right away, counting them '
+                               'in a background thread. The bar shows an '
+                               'indeterminate graph until the count is done. '
+                               'Test modules get imported from that thread '
+                               'while tests run. Ignored, with a warning, if '
+                               'a plugin with loading hooks that keep global '
+                               'state, like --with-isolation, is on. '
+                               '[NOSE_PROGRESSIVE_BACKGROUND_COUNT]')
+
+        parser.add_option('--progressive-worker-status',
+                          action='store_true',
+                          dest='worker_status',
+                          default=env.get('NOSE_PROGRESSIVE_WORKER_STATUS',
+                                          False),
+                          help="When running tests in several processes with "
+                               "--processes, show each worker's current test "
+                               "on the progress bar, rather than just the "
+                               'latest one to start. '
+                               '[NOSE_PROGRESSIVE_WORKER_STATUS]')
 
     def configure(self, options, conf):
         """Turn style-forcing on if bar-forcing is on.
@@ -160,6 +416,14 @@ class ProgressivePlugin(Plugin):
                    'or the other to avoid a mess.')
         if options.with_bar:
             options.with_styling = True
+        # Resolve paths now, before nose has a chance to change directories
+        # with -w:
+        self._cache_dir = abspath(options.cache_dir)
+        for name in ('events_path', 'junit_path', 'record_path'):
+            path = getattr(options, name)
+            # The event log may go to a file descriptor, given by number.
+            if path and not (name == 'events_path' and path.isdigit()):
+                setattr(options, name, abspath(path))
 
     def prepareTestLoader(self, loader):
         """Insert ourselves into loader calls to count tests.
@@ -170,6 +434,15 @@ class ProgressivePlugin(Plugin):
         call to do the load twice: once for the actual test running and again
         to yield something we can iterate over to do the count.
 
+        With --progressive-single-pass, we instead load once, expand all the
+        lazy suites in place, count that, and run it. Reordering tests needs
+        them all in hand as well, so --progressive-failed-first and
+        --progressive-duration-order imply single-pass. With
+        --progressive-manifest, the counting load skips importing files whose
+        counts we remember from a previous run. With
+        --progressive-background-count, the counting load happens in another
+        thread, with a loader of its own, while the tests run.
+
         """
         def capture_suite(orig_method, *args, **kwargs):
             """Intercept calls to the loader before they get lazy.
@@ -178,7 +451,29 @@ class ProgressivePlugin(Plugin):
             count the tests therein.
 
             """
-            self._totalTests += orig_method(*args, **kwargs).countTestCases()
+            options = self.conf.options
+            reordering = options.failed_first or options.duration_order
+            if options.single_pass or reordering:
+                suite = materialize(orig_method(*args, **kwargs))
+                self._totalTests += suite.countTestCases()
+                if reordering:
+                    history = self._runHistory()
+                    reorder(suite,
+                            lambda test: history.outcome(run_selector(test)),
+                            options.failed_first,
+                            options.duration_order)
+                return suite
+
+            if self.conf.options.background_count:
+                self._countInBackground(loader, *args, **kwargs)
+                return orig_method(*args, **kwargs)
+
+            if self.conf.options.use_manifest:
+                self._totalTests += self._countWithManifest(
+                    loader, orig_method, *args, **kwargs)
+            else:
+                self._totalTests += orig_method(*args,
+                                                **kwargs).countTestCases()
 
             # Clear out the loader's cache. Otherwise, it never finds any tests
             # for the actual test run:
@@ -190,19 +485,192 @@ class ProgressivePlugin(Plugin):
         # or even TestProgram.createTests. createTests seems to be main top-
         # level caller of loader methods, and nose.core.collector() (which
         # isn't even called in nose) is an alternate one.
+        # The multiprocess runner needs this to make loaders in the workers:
+        self._loaderClass = loader.__class__
+
+        if self.conf.options.background_count:
+            racers = self._backgroundCountRacers()
+            if racers:
+                warn('Not counting tests in the background, since that would '
+                     'race with the loading hooks of these plugins: %s' %
+                     ', '.join(racers))
+                self.conf.options.background_count = False
+
         if hasattr(loader, 'loadTestsFromNames'):
             loader.loadTestsFromNames = partial(capture_suite,
                                                 loader.loadTestsFromNames)
 
+    def _backgroundCountRacers(self):
+        """Return the names of the other enabled plugins with hooks that a
+        background count would fire while tests run.
+
+        Those hooks, like the isolation plugin's snapshots of
+        ``sys.modules``, keep state that the tests' loading and running
+        depend on.
+
+        """
+        return [plugin.name
+                for plugin in getattr(self.conf.plugins, 'plugins', [])
+                if plugin is not self and
+                   any(hasattr(plugin, hook) for hook in _LOADING_HOOKS)]
+
+    def _countInBackground(self, loader, *args, **kwargs):
+        """Start counting, in a separate thread, the tests a call to
+        ``loader.loadTestsFromNames()`` with the given args would load."""
+        # A loader of our own keeps us out of the way of the real loader's
+        # visited-paths cache and context bookkeeping:
+        counter = loader.__class__(config=loader.config,
+                                   importer=loader.importer,
+                                   workingDir=loader.workingDir,
+                                   selector=loader.selector)
+
+        def count():
+            try:
+                if self.conf.options.use_manifest:
+                    total = self._countWithManifest(
+                        counter, counter.loadTestsFromNames, *args, **kwargs)
+                else:
+                    total = counter.loadTestsFromNames(
+                        *args, **kwargs).countTestCases()
+            except Exception:
+                # Leave the bar indeterminate rather than crash a thread
+                # nobody is watching.
+                total = None
+            self._countFinished(total)
+
+        with self._countLock:
+            self._countsPending += 1
+        thread = Thread(target=count)
+        thread.daemon = True  # Don't hold up exit if the tests finish first.
+        thread.start()
+
+    def _countFinished(self, total):
+        """Add a background count to the total, and tell the bar if that was
+        the last one outstanding."""
+        with self._countLock:
+            self._countsPending -= 1
+            if total is None:
+                self._countFailed = True
+            else:
+                self._totalTests += total
+            self._updateBarMax()
+
+    def _updateBarMax(self):
+        """Give the bar its maximum if all counts are in.
+
+        Call only while holding ``_countLock``.
+
+        """
+        if (hasattr(self, 'bar') and not self._countsPending and
+            not self._countFailed):
+            # 1 in case counting came up with 0
+            self.bar.max = self._totalTests or 1
+
+    def _countWithManifest(self, loader, orig_method, *args, **kwargs):
+        """Count the tests ``orig_method`` would load, consulting and then
+        updating the collection manifest."""
+        manifest = CollectionManifest(join(self._cache_dir, 'manifest.json'),
+                                      self._selection())
+        # loadTestsFromDir() looks this up on the instance for each file.
+        # Another plugin may have patched it there already.
+        patched = loader.__dict__.get('loadTestsFromName')
+        loader.loadTestsFromName = manifest.counting_loader(
+            loader.loadTestsFromName)
+        try:
+            count = orig_method(*args, **kwargs).countTestCases()
+        finally:
+            if patched is None:
+                del loader.loadTestsFromName
+            else:
+                loader.loadTestsFromName = patched
+        manifest.save()
+        return count
+
+    def _runHistory(self):
+        """Return the ``RunHistory``, or None if no option needs one."""
+        options = self.conf.options
+        if self._history is None and (options.show_eta or
+                                      options.failed_first or
+                                      options.duration_order):
+            self._history = RunHistory(
+                join(self._cache_dir, 'history.sqlite'),
+                repr([self._selection(), sorted(self.conf.testNames or [])]))
+        return self._history
+
+    def _selection(self):
+        """Return a string summarizing the options which affect which tests
+        get collected, so the manifest can tell when its counts are stale."""
+        def patterns(regexes):
+            return [r.pattern for r in regexes or []]
+        conf = self.conf
+        return repr([conf.testMatch.pattern,
+                     patterns(conf.include),
+                     patterns(conf.exclude),
+                     patterns(conf.ignoreFiles),
+                     getattr(conf.options, 'attr', None),
+                     getattr(conf.options, 'eval_attr', None)])
+
     def prepareTestRunner(self, runner):
         """Replace TextTestRunner with something that prints fewer dots."""
+        with self._countLock:
+            # None tells the bar we don't know yet, or won't ever.
+            total = (None if self._countsPending or self._countFailed
+                     else self._totalTests)
+        stream = runner.stream
+        if self._output_thread is not None:
+            # Send the result's and the bar's output through the same thread
+            # as the StreamWrappers', so it all stays in order.
+            stream = _WritelnDecorator(self._queued(stream))
+        listeners = []
+        if self.conf.options.events_path:
+            listeners.append(EventLog.open(self.conf.options.events_path))
+        if self.conf.options.junit_path:
+            listeners.append(JUnitReport.open(self.conf.options.junit_path))
+        if listeners:
+            self._events = (listeners[0] if len(listeners) == 1 else
+                            Listeners(listeners))
+        if self.conf.options.record_path:
+            self._recording = Recording.open(self.conf.options.record_path)
+        if getattr(self.conf, 'multiprocess_workers', 0):
+            # The multiprocess plugin is on. Do what it would, but keep the
+            # bar going. Import late, since not every platform has
+            # multiprocessing.
+            from noseprogressive.parallel import ProgressiveMultiProcessRunner
+            return ProgressiveMultiProcessRunner(
+                self._cwd,
+                total,
+                stream,
+                history=self._runHistory(),
+                events=self._events,
+                recording=self._recording,
+                verbosity=self.conf.verbosity,
+                config=self.conf,
+                loaderClass=self._loaderClass)
         return ProgressiveRunner(self._cwd,
-                                 self._totalTests,
-                                 runner.stream,
+                                 total,
+                                 stream,
+                                 history=self._runHistory(),
+                                 events=self._events,
+                                 recording=self._recording,
                                  verbosity=self.conf.verbosity,
                                  config=self.conf)  # So we don't get a default
                                                     # NoPlugins manager
 
+    def startContext(self, context):
+        """Start timing a module's or class's setup, if we're timing."""
+        if self._timings is not None:
+            self._timings.start_context(context_name(context))
+
+    def stopContext(self, context):
+        """Note when a module's or class's teardown finished."""
+        if self._timings is not None:
+            self._timings.stop_context(context_name(context))
+
     def prepareTestResult(self, result):
-        """Hang onto the progress bar so the StreamWrappers can grab it."""
-        self.bar = result.bar
+        """Hang onto the progress bar so the StreamWrappers can grab it, and
+        onto the timings so we can time fixtures."""
+        self._timings = result.timings
+        with self._countLock:
+            self.bar = result.bar
+            if self.conf.options.background_count:
+                self._updateBarMax()
@@ -0,0 +1,274 @@
+"""Recordings of what the progress bar and the traceback formatter are asked to
+show during a run, and replays of them for benchmarking rendering"""
+
+from __future__ import with_statement
+import gzip
+import json
+import re
+from signal import getsignal, signal, SIGWINCH
+from threading import Lock
+
+from blessings import Terminal
+
+from noseprogressive.bar import ProgressBar
+from noseprogressive.tracebacks import TracebackFormatter
+from noseprogressive.utils import as_unicode
+
+
+__all__ = ['Recording', 'RecordingBar', 'HeadlessTerminal', 'load', 'replay']
+
+
+class Recording(object):
+    """A gzipped stream of JSON lists, one per line, one per thing the bar or
+    the formatter was asked to do
+
+    Each list starts with the kind of event:
+
+    ``["setup", {...}]``
+        How the bar and the formatter were set up, and the terminal's size.
+        Always comes first.
+    ``["start", selector, number, status]``
+        A test started, and the bar was updated.
+    ``["write", data]``
+        A test wrote to stdout or stderr.
+    ``["max", value]``
+        The bar learned how many tests there are.
+    ``["headline", text]``
+        A failure's headline was printed.
+    ``["print", text]``
+        Something else was printed between tests, like a skip's reason.
+    ``["traceback", frames, exception]``
+        A traceback was formatted and printed.
+    ``["resize", cols, lines]``
+        The terminal changed size.
+    ``["erase"]``
+        The bar was erased for the summary.
+
+    Tests' output and tracebacks are kept as they came, so a recording of a
+    run is about as big as its output, before compression.
+
+    """
+    def __init__(self, file):
+        self._file = file
+        self.closed = False
+        # The bar is updated from a thread of its own in multiprocess runs.
+        self._lock = Lock()
+
+    @classmethod
+    def open(cls, path):
+        return cls(gzip.open(path, 'wb'))
+
+    def _write(self, *event):
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        with self._lock:
+            # A timer or a signal can come in after the run is over.
+            if not self.closed:
+                self._file.write(line.encode('utf-8'))
+
+    def setup(self, **settings):
+        self._write('setup', settings)
+
+    def start(self, selector, number, status):
+        self._write('start', selector, number, status)
+
+    def write(self, data):
+        self._write('write', as_unicode(data))
+
+    def max(self, value):
+        self._write('max', value)
+
+    def headline(self, text):
+        self._write('headline', as_unicode(text))
+
+    def printed(self, text):
+        self._write('print', as_unicode(text))
+
+    def traceback(self, frames, exception):
+        """
+        :arg frames: The frames to print, as ``extract_tb()`` gives them
+        :arg exception: The exception as formatted by
+            ``format_exception_only()``
+
+        """
+        self._write('traceback',
+                    [(as_unicode(file),
+                      line_number,
+                      as_unicode(function),
+                      # Python 2 source from eggs and zips is bytes:
+                      text if text is None else as_unicode(text))
+                     for file, line_number, function, text in frames],
+                    as_unicode(exception))
+
+    def resize(self, cols, lines):
+        self._write('resize', cols, lines)
+
+    def erase(self):
+        self._write('erase')
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._file.close()
+
+
+class RecordingBar(object):
+    """A progress bar, or a stand-in for one, that tells a ``Recording`` what
+    it's asked to do
+
+    Anything not recorded goes straight through to the bar. Once the
+    recording is closed, the next SIGWINCH puts back whatever handled it
+    before.
+
+    """
+    def __init__(self, bar, recording, term):
+        self._bar = bar
+        self._recording = recording
+        self._term = term
+        # Take SIGWINCH over from the bar, and pass it along:
+        self._previous_winch = getsignal(SIGWINCH)
+        signal(SIGWINCH, self._handle_winch)
+
+    def __getattr__(self, name):
+        return getattr(self._bar, name)
+
+    def _get_max(self):
+        return self._bar.max
+
+    def _set_max(self, value):
+        self._recording.max(value)
+        self._bar.max = value
+
+    max = property(_get_max, _set_max)
+
+    def update(self, test_path, number, status=''):
+        self._recording.start(test_path, number, status)
+        self._bar.update(test_path, number, status)
+
+    def write(self, stream, data):
+        self._recording.write(data)
+        self._bar.write(stream, data)
+
+    def erase(self):
+        self._recording.erase()
+        self._bar.erase()
+
+    def dodging(self):
+        return self._bar.dodging()
+
+    def _handle_winch(self, *args):
+        if self._recording.closed:
+            signal(SIGWINCH, self._previous_winch)
+            if callable(self._previous_winch):
+                self._previous_winch(*args)
+            return
+        self._bar._handle_winch(*args)
+        self._recording.resize(self._term.width or 80,
+                               self._term.height or 24)
+
+
+class HeadlessTerminal(Terminal):
+    """A 256-color terminal of whatever size we say, writing to a stream that
+    needn't be a tty"""
+
+    def __init__(self, cols, lines, stream):
+        super(HeadlessTerminal, self).__init__(kind='xterm-256color',
+                                               stream=stream,
+                                               force_styling=True)
+        self.resize(cols, lines)
+
+    def resize(self, cols, lines):
+        self._size = cols, lines
+
+    @property
+    def width(self):
+        return self._size[0]
+
+    @property
+    def height(self):
+        return self._size[1]
+
+
+def load(path):
+    """Return the events in the recording at ``path``, as a list."""
+    file = gzip.open(path, 'rb')
+    try:
+        return [json.loads(line.decode('utf-8')) for line in file]
+    finally:
+        file.close()
+
+
+def replay(events, stream):
+    """Show a run's worth of ``events``, as ``load()`` returns them, on a
+    fresh ``ProgressBar`` and ``TracebackFormatter`` writing to ``stream``.
+
+    The terminal is headless and the size the recorded one was. Timers are
+    the only things that make the output depend on how long the replay takes,
+    so the bar's frame rate limit isn't replayed.
+
+    """
+    kind, settings = events[0]
+    if kind != 'setup':
+        raise ValueError('A recording should start with a setup event, not '
+                         '%r.' % kind)
+    term = HeadlessTerminal(settings['cols'], settings['lines'], stream)
+    max_value = settings['max']
+    bar = ProgressBar(max_value if max_value is None else max_value or 1,
+                      term,
+                      settings['filled_color'],
+                      settings['empty_color'],
+                      buffer_writes=settings['buffer_writes'],
+                      status_width=settings['status_width'])
+    formatter = TracebackFormatter(settings['cwd'],
+                                   term,
+                                   settings['function_color'],
+                                   settings['dim_color'],
+                                   settings['editor'],
+                                   settings['editor_shortcut_template'],
+                                   settings['source_context'])
+    for event in events[1:]:
+        kind = event[0]
+        if kind == 'start':
+            bar.update(*event[1:])
+        elif kind == 'write':
+            bar.write(stream, event[1])
+        elif kind in ('headline', 'print'):
+            with bar.dodging():
+                stream.write(event[1])
+        elif kind == 'traceback':
+            with bar.dodging():
+                stream.write(''.join(formatter.format(event[1],
+                                                      *_exception(event[2]))))
+        elif kind == 'max':
+            bar.max = event[1]
+        elif kind == 'resize':
+            term.resize(*event[1:])
+            bar._handle_winch()
+        elif kind == 'erase':
+            bar.erase()
+    bar.flush_writes()
+
+
+class ReplayedException(Exception):
+    """An exception standing in for a recorded one"""
+
+
+# "SomeError: message", where the message may run over several lines:
+_EXCEPTION = re.compile(r'([\w.]+)(?:: (.*))?$', re.DOTALL)
+
+
+def _exception(text):
+    """Return an exception type and value that ``format_exception_only()``
+    formats as ``text``, or near enough."""
+    text = text.rstrip('\n')
+    match = _EXCEPTION.match(text)
+    if match:
+        name, message = match.groups()
+    else:  # A SyntaxError, say, whose first lines point at the bad code
+        name, message = ReplayedException.__name__, text
+    # Under Python 3, format_exception_only() leaves out this module:
+    cls = type(str(name), (ReplayedException,), {'__module__': '__main__'})
+    if message is None:
+        return cls, cls()
+    if not isinstance(message, str):  # It's unicode under Python 2.
+        message = message.encode('utf-8')
+    return cls, cls(message)
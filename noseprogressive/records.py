@@ -0,0 +1,318 @@
+"""Compact records of failed tests"""
+
+from array import array
+from itertools import islice
+try:
+    from collections.abc import Sequence
+except ImportError:  # Python < 3.3
+    from collections import Sequence
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import re
+from tempfile import TemporaryFile
+from traceback import format_exception_only, format_list
+
+from noseprogressive.tracebacks import relevant_frames, source_line
+from noseprogressive.utils import TestFrameFinder
+
+
+__all__ = ['FailureRecord', 'FailureGroups', 'release_frames', 'SpilledTest',
+           'SpillingList']
+
+
+class FailureRecord(object):
+    """What we keep of a test failure or error once it's been reported
+
+    It takes the place of the formatted traceback strings unittest keeps in
+    ``TestResult.errors`` and ``failures``. Those are rendered up front
+    whether anybody looks at them or not, while the traceback they come from
+    holds every frame of the failed test---and every local in them---alive
+    until the garbage collector gets around to it. A record instead keeps
+    the traceback's frames as plain (path, line number, function, source
+    line) tuples and the exception as text; the string is rendered only
+    when somebody asks for it, as a plugin reading ``result.errors`` might.
+    The source lines are usually None, to be read only if needed.
+
+    Since unittest promises strings there, a record otherwise acts like the
+    string it renders: ``in``, ``len()``, ``+``, and string methods like
+    ``splitlines()`` all work on the rendered traceback. Code that checks
+    ``isinstance(tb, str)`` should call ``str()`` on it first.
+
+    """
+    __slots__ = ['selector', 'exception_type', 'exception', 'frames',
+                 'test_frame_index']
+
+    def __init__(self, selector, exception_type, exception, frames,
+                 test_frame_index=None):
+        """
+        :arg selector: The failed test's nose selector
+        :arg exception_type: The name of the exception's class
+        :arg exception: The exception as formatted by
+            ``format_exception_only()``, perhaps over several lines
+        :arg frames: The relevant part of the traceback, as extract_tb() gives
+            it
+        :arg test_frame_index: The index in ``frames`` of the test's own
+            frame, or None if we couldn't tell which it was
+
+        """
+        self.selector = selector
+        self.exception_type = exception_type
+        self.exception = exception
+        self.frames = frames
+        self.test_frame_index = test_frame_index
+
+    @classmethod
+    def from_exc_info(cls, selector, err, test):
+        """Make a record of an exc_info()-style triple.
+
+        The traceback is walked just once, to pick out the relevant frames and
+        find the test's among them.
+
+        :arg test: The test that failed
+
+        """
+        exception_type, exception_value, tb = err
+        finder = TestFrameFinder(test)
+        frames = []
+        for frame in relevant_frames(
+                tb,
+                exception_type is getattr(test, 'failureException', None)):
+            finder.see(len(frames), frame[0], frame[2])
+            frames.append(frame)
+        return cls(selector,
+                   getattr(exception_type, '__name__', str(exception_type)),
+                   ''.join(format_exception_only(exception_type,
+                                                 exception_value)),
+                   frames,
+                   finder.best)
+
+    def __getstate__(self):
+        return [getattr(self, slot) for slot in self.__slots__]
+
+    def __setstate__(self, state):
+        for slot, value in zip(self.__slots__, state):
+            setattr(self, slot, value)
+
+    def __str__(self):
+        """Return the traceback the way unittest would have formatted it."""
+        return ''.join(['Traceback (most recent call last):\n'] +
+                       format_list([(file,
+                                     line_number,
+                                     function,
+                                     source_line(file, line_number, text))
+                                    for file, line_number, function, text in
+                                    self.frames]) +
+                       [self.exception])
+
+    def __repr__(self):
+        return '<FailureRecord %s: %s>' % (self.selector, self.exception_type)
+
+    def __getattr__(self, name):
+        """Delegate string methods, like ``splitlines()``, to the rendered
+        traceback."""
+        # Unset slots and special names, which pickle and copy probe for,
+        # aren't the string's business.
+        if name in self.__slots__ or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(str(self), name)
+
+    def __contains__(self, text):
+        return text in str(self)
+
+    def __len__(self):
+        return len(str(self))
+
+    def __add__(self, other):
+        return str(self) + other
+
+    def __radd__(self, other):
+        return other + str(self)
+
+
+class FailureGroup(object):
+    """Failures that look like the same problem"""
+    __slots__ = ['number', 'count', 'exception']
+
+    def __init__(self, number, exception):
+        self.number = number
+        self.count = 0
+        self.exception = exception
+
+
+class FailureGroups(object):
+    """Failures sorted into groups that seem to have the same cause
+
+    A failure's fingerprint is its exception type, its message with any
+    numbers masked out, and the frames it went through below the test's own.
+    When a shared fixture or helper breaks, every test that uses it ends up in
+    the same group, while tests that fail on their own lines don't. Groups are
+    numbered in the order they first turn up, from 1.
+
+    """
+    _NUMBERS = re.compile(r'0x[0-9a-fA-F]+|\d+')
+
+    def __init__(self):
+        self._groups = {}  # fingerprint -> FailureGroup
+
+    def __len__(self):
+        return len(self._groups)
+
+    def add(self, record, test_frame_index=None):
+        """Put a failure in its group, and return the group.
+
+        :arg test_frame_index: The index in ``record.frames`` of the test's
+            frame, if known
+
+        """
+        frames = record.frames
+        if test_frame_index is not None:
+            # Frames below the test's, or the test's alone if it raised the
+            # exception itself.
+            frames = islice(frames,
+                            min(test_frame_index + 1, len(frames) - 1),
+                            None)
+        fingerprint = (record.exception_type,
+                       self._NUMBERS.sub('#', record.exception),
+                       tuple((path, line_number, function) for
+                             path, line_number, function, _ in frames))
+        group = self._groups.get(fingerprint)
+        if group is None:
+            lines = record.exception.strip().splitlines()
+            group = self._groups[fingerprint] = FailureGroup(
+                len(self._groups) + 1, lines[-1] if lines else '')
+        group.count += 1
+        return group
+
+    def repeated(self):
+        """Return the groups of more than one failure, biggest first."""
+        return sorted((g for g in self._groups.values() if g.count > 1),
+                      key=lambda g: (-g.count, g.number))
+
+
+def release_frames(tb):
+    """Clear the locals out of a traceback's frames, so whatever they refer to
+    can be freed right away instead of waiting for a garbage collection.
+
+    Frames still running, like the test runner's own, are left alone. Before
+    Python 3.4, frames can't be cleared, and this does nothing.
+
+    """
+    while tb is not None:
+        clear = getattr(tb.tb_frame, 'clear', None)
+        if clear is None:
+            return
+        try:
+            clear()
+        except RuntimeError:  # The frame is still executing.
+            pass
+        tb = tb.tb_next
+
+
+class SpilledTest(object):
+    """A stand-in for a test whose result entry went to disk
+
+    Test objects can't be pickled, and it's them we most want to be rid of,
+    so we keep only what the multiprocess plugin keeps of tests it sends
+    between processes: the answers to ``id()``, ``shortDescription()``, and
+    ``str()``.
+
+    """
+    __slots__ = ['_id', '_description', '_str']
+
+    def __init__(self, test):
+        self._id = getattr(test, 'id', lambda: None)()
+        self._description = getattr(test, 'shortDescription', lambda: None)()
+        self._str = str(test)
+
+    def __getstate__(self):
+        return self._id, self._description, self._str
+
+    def __setstate__(self, state):
+        self._id, self._description, self._str = state
+
+    def id(self):
+        return self._id
+
+    def shortDescription(self):
+        return self._description
+
+    def __str__(self):
+        return self._str
+
+    def __repr__(self):
+        return '<SpilledTest %s>' % self._str
+
+
+class SpillingList(Sequence):
+    """A list of (test, artifact) pairs, like ``TestResult.errors``, that
+    keeps only its first few items in memory and the rest in a temp file
+
+    When a broken environment makes every test in a huge suite fail, this is
+    what keeps memory use flat. Items that go to disk have their tests
+    swapped for ``SpilledTest`` stand-ins. They're read back one at a time
+    when somebody indexes or iterates, and ``len()`` is always right.
+
+    """
+    def __init__(self, max_in_memory):
+        self.max_in_memory = max_in_memory
+        self._memory = []
+        self._file = None  # opened on the first spill
+        self._offsets = array('l')  # where each spilled item starts
+
+    def __len__(self):
+        return len(self._memory) + len(self._offsets)
+
+    def append(self, item):
+        if len(self._memory) < self.max_in_memory:
+            self._memory.append(item)
+            return
+        if self._file is None:
+            self._file = TemporaryFile()
+        self._file.seek(0, 2)
+        self._offsets.append(self._file.tell())
+        test, artifact = item
+        if not isinstance(test, (basestring, SpilledTest)):
+            test = SpilledTest(test)
+        try:
+            data = pickle.dumps((test, artifact), pickle.HIGHEST_PROTOCOL)
+        except Exception:  # Some plugin's artifact won't pickle. Keep text.
+            data = pickle.dumps((test, '%s' % (artifact,)),
+                                pickle.HIGHEST_PROTOCOL)
+        self._file.write(data)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def _spilled(self, index):
+        self._file.seek(self._offsets[index])
+        return pickle.load(self._file)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('SpillingList index out of range')
+        in_memory = len(self._memory)
+        if index < in_memory:
+            return self._memory[index]
+        return self._spilled(index - in_memory)
+
+    def __iter__(self):
+        for item in self._memory:
+            yield item
+        for index in range(len(self._offsets)):
+            yield self._spilled(index)
+
+    def close(self):
+        """Delete the temp file. What was on disk can't be read after this."""
+        if self._file is not None:
+            self._file.close()
+
+    def __repr__(self):
+        return '<SpillingList of %s, %s on disk>' % (len(self),
+                                                     len(self._offsets))
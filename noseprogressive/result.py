@@ -1,4 +1,6 @@
 from __future__ import with_statement
+from os import fdopen
+from tempfile import mkstemp
 
 from blessings import Terminal
 from nose.plugins.skip import SkipTest
@@ -6,8 +8,13 @@ from nose.result import TextTestResult
 from nose.util import isclass
 
 from noseprogressive.bar import ProgressBar, NullProgressBar
-from noseprogressive.tracebacks import format_traceback, extract_relevant_tb
-from noseprogressive.utils import nose_selector, index_of_test_frame
+from noseprogressive.history import Estimator
+from noseprogressive.records import (FailureGroups, FailureRecord,
+                                     release_frames, SpillingList)
+from noseprogressive.recording import RecordingBar
+from noseprogressive.timing import context_name, RateWatch, Timings
+from noseprogressive.tracebacks import TracebackFormatter
+from noseprogressive.utils import as_unicode, nose_selector
 
 
 class ProgressiveResult(TextTestResult):
@@ -18,101 +25,277 @@ class ProgressiveResult(TextTestResult):
     stderr/out wrapping.
 
     """
-    def __init__(self, cwd, total_tests, stream, config=None):
+    STATUS_WIDTH = 20  # for the rate and ETA, when shown
+
+    def __init__(self, cwd, total_tests, stream, config=None, history=None,
+                 events=None, recording=None):
+        """
+        :arg history: A ``RunHistory`` to record test outcomes in and to draw
+            ETAs from
+        :arg events: An ``EventLog`` to report tests' starts and outcomes to
+        :arg recording: A ``Recording`` to tell what the bar and the traceback
+            formatter are asked to show, for replaying later
+
+        """
         super(ProgressiveResult, self).__init__(stream, None, 0, config=config)
         self._cwd = cwd
         self._options = config.options
+        if self._options.max_records:
+            # Past this many, errors and failures go to disk.
+            self.errors = SpillingList(self._options.max_records)
+            self.failures = SpillingList(self._options.max_records)
+        self._history = history
+        self._events = events
+        self._recording = recording
+        self._outcome = None  # of the current test, for the event log
+        self._test = None  # between startTest() and stopTest()
+        self._groups = (FailureGroups() if self._options.group_failures
+                        else None)
+        # When failures come too fast, their tracebacks go to a file:
+        self._storm_watch = (RateWatch(self._options.storm_threshold)
+                             if self._options.storm_threshold else None)
+        self._storming = False
+        self._storm_file = None
+        self._storm_path = None
+        self._storm_count = 0  # of tracebacks sent to the file
+        # nose's debugger plugin wants the frames of failed tests intact.
+        self._keep_frames = any(getattr(self._options, o, False) for o in
+                                ['debugBoth', 'debugErrors', 'debugFailures'])
+        self._estimator = (Estimator(history) if self._options.show_eta
+                           else None)
+        # Durations of tests and their fixtures. The plugin feeds it the
+        # fixtures' comings and goings.
+        self.timings = (Timings() if (history is not None or
+                                      events is not None or
+                                      self._options.slowest)
+                        else None)
         self._term = Terminal(stream=stream,
                               force_styling=config.options.with_styling)
 
-        if self._term.is_a_tty or self._options.with_bar:
-            # 1 in case test counting failed and returned 0
-            self.bar = ProgressBar(total_tests or 1,
-                                   self._term,
-                                   config.options.bar_filled_color,
-                                   config.options.bar_empty_color)
-        else:
-            self.bar = NullProgressBar()
+        self.bar = self._makeBar(total_tests)
+
+        self._formatter = TracebackFormatter(
+            cwd,
+            self._term,
+            self._options.function_color,
+            self._options.dim_color,
+            self._options.editor,
+            self._options.editor_shortcut_template,
+            self._options.source_context)
+
+        if recording is not None:
+            recording.setup(cwd=cwd,
+                            max=total_tests,
+                            cols=self._term.width or 80,
+                            lines=self._term.height or 24,
+                            status_width=(self.STATUS_WIDTH if
+                                          self._estimator else 0),
+                            filled_color=self._options.bar_filled_color,
+                            empty_color=self._options.bar_empty_color,
+                            buffer_writes=self._options.buffer_output,
+                            function_color=self._options.function_color,
+                            dim_color=self._options.dim_color,
+                            editor=self._options.editor,
+                            editor_shortcut_template=
+                                self._options.editor_shortcut_template,
+                            source_context=self._options.source_context)
+            self.bar = RecordingBar(self.bar, recording, self._term)
 
         # Declare errorclass-savviness so ErrorClassPlugins don't monkeypatch
         # half my methods away:
         self.errorClasses = {}
 
+    def _makeBar(self, total_tests):
+        """Return a progress bar, or a stand-in if we shouldn't show one."""
+        if self._term.is_a_tty or self._options.with_bar:
+            # 1 in case test counting failed and returned 0. None means the
+            # tests are still being counted.
+            return ProgressBar(total_tests if total_tests is None
+                               else total_tests or 1,
+                               self._term,
+                               self._options.bar_filled_color,
+                               self._options.bar_empty_color,
+                               self._options.max_fps,
+                               self._options.buffer_output,
+                               self.STATUS_WIDTH if self._estimator else 0)
+        return NullProgressBar()
+
     def startTest(self, test):
         """Update the progress bar."""
         super(ProgressiveResult, self).startTest(test)
-        self.bar.update(nose_selector(test), self.testsRun)
-
-    def _printTraceback(self, test, err):
-        """Print a nicely formatted traceback.
+        self._test = test
+        if self.timings is not None:
+            self.timings.start_test()
+        if self._events is not None:
+            self._outcome = {'event': 'pass'}
+            self._events.test_started(nose_selector(test))
+        if self._estimator is None:
+            self.bar.update(nose_selector(test), self.testsRun)
+        else:
+            self.bar.update(nose_selector(test),
+                            self.testsRun,
+                            self._estimator.status(self.bar.max))
+
+    def stopTest(self, test):
+        """Note how long the test took and how it went, if we're keeping
+        track."""
+        super(ProgressiveResult, self).stopTest(test)
+        self._test = None
+        if self.timings is not None:
+            selector = nose_selector(test)
+            duration = self.timings.stop_test(selector)
+            if self._estimator is not None:
+                self._estimator.test_finished(selector, duration)
+            if self._history is not None:
+                # nose and _recordError() set this on failure.
+                self._history.record(selector,
+                                     duration,
+                                     getattr(test, 'passed', None) is False)
+            if self._events is not None:
+                self._events.test_finished(selector, duration, self._outcome)
+
+    def _noteOutcome(self, kind, exception=None, traceback=None):
+        """Remember how the current test came out, for the event log.
+
+        :arg kind: The name of the outcome, like "fail"
+        :arg exception: A ``FailureRecord`` or a skip reason
+        :arg traceback: Whether to include the traceback of the failure
 
-        :arg err: exc_info()-style traceback triple
+        """
+        if self._events is None:
+            return
+        self._outcome = {'event': kind}
+        if isinstance(exception, FailureRecord):
+            if traceback:
+                self._outcome['traceback'] = as_unicode(str(exception))
+            exception = exception.exception.strip()
+        if exception is not None:
+            if isinstance(exception, Exception):
+                exception = '%s' % exception
+            self._outcome['exception'] = as_unicode(exception)
+
+    def _record(self, test, err):
+        """Return a ``FailureRecord`` of ``err``."""
+        return FailureRecord.from_exc_info(nose_selector(test), err, test)
+
+    def _releaseFrames(self, err):
+        """Free the locals of the frames in ``err``'s traceback, now that
+        we're done with them, unless a debugger might want them next."""
+        if not self._keep_frames:
+            release_frames(err[2])
+
+    def _printFailure(self, kind, test, err, record):
+        """Print the headline and a nicely formatted traceback of a failure.
+
+        If we're grouping failures and this one's like an earlier one, print
+        just the headline, with a reference to the earlier one. If failures
+        are coming too fast, send the traceback to the storm file instead.
+
+        :arg kind: The (string) type of failure, like "FAIL"
         :arg test: the test that precipitated this call
+        :arg err: exc_info()-style traceback triple
+        :arg record: the ``FailureRecord`` of ``err``, whose frames we print
 
         """
+        stormy = self._storm_watch is not None and self._storm_watch.tick()
+        if not stormy:
+            self._storming = False
+
         # Don't bind third item to a local var; that can create
         # circular refs which are expensive to collect. See the
         # sys.exc_info() docs.
         exception_type, exception_value = err[:2]
-        # TODO: In Python 3, the traceback is attached to the exception
-        # instance through the __traceback__ attribute. If the instance
-        # is saved in a local variable that persists outside the except
-        # block, the traceback will create a reference cycle with the
-        # current frame and its dictionary of local variables. This will
-        # delay reclaiming dead resources until the next cyclic garbage
-        # collection pass.
-
-        extracted_tb = extract_relevant_tb(
-            err[2],
-            exception_type,
-            exception_type is test.failureException)
-        test_frame_index = index_of_test_frame(
-            extracted_tb,
-            exception_type,
-            exception_value,
-            test)
+        extracted_tb = record.frames
+        test_frame_index = record.test_frame_index
+
+        note = ''
+        if self._groups is not None:
+            group = self._groups.add(record, test_frame_index)
+            if group.count > 1:
+                self._printHeadline(kind,
+                                    test,
+                                    note='  (same as #%s)' % group.number)
+                return
+            note = '  #%s' % group.number
+        if stormy:
+            self._deferTraceback(kind, test, record)
+        self._printHeadline(kind, test, note=note)
+        if stormy:
+            return
+
         if test_frame_index:
             # We have a good guess at which frame is the test, so
             # trim everything until that. We don't care to see test
             # framework frames.
             extracted_tb = extracted_tb[test_frame_index:]
 
+        if self._recording is not None:
+            self._recording.traceback(extracted_tb, record.exception)
         with self.bar.dodging():
             self.stream.write(''.join(
-                format_traceback(
-                    extracted_tb,
-                    exception_type,
-                    exception_value,
-                    self._cwd,
-                    self._term,
-                    self._options.function_color,
-                    self._options.dim_color,
-                    self._options.editor,
-                    self._options.editor_shortcut_template)))
-
-    def _printHeadline(self, kind, test, is_failure=True):
+                self._formatter.format(extracted_tb,
+                                       exception_type,
+                                       exception_value)))
+
+    def _deferTraceback(self, kind, test, record):
+        """Write a plain traceback to the storm file, which is quicker than
+        formatting it for the terminal and easier to read than thousands
+        of them scrolling by.
+
+        Say so, the first time in each storm.
+
+        """
+        if self._storm_file is None:
+            fd, self._storm_path = mkstemp(prefix='nose-progressive-',
+                                           suffix='.txt')
+            self._storm_file = fdopen(fd, 'w')
+        self._storm_file.write('%s: %s\n%s\n' % (kind,
+                                                 nose_selector(test),
+                                                 record))
+        self._storm_count += 1
+        if not self._storming:
+            self._storming = True
+            self._print('\n' +
+                        self._term.bold('Failures are coming fast. Writing '
+                                        'tracebacks to %s until they slow '
+                                        'down.' % self._storm_path))
+
+    def _printHeadline(self, kind, test, is_failure=True, note=''):
         """Output a 1-line error summary to the stream if appropriate.
 
         The line contains the kind of error and the pathname of the test.
 
         :arg kind: The (string) type of incident the precipitated this call
         :arg test: The test that precipitated this call
+        :arg note: Something to tack onto the end, like a failure group number
 
         """
         if is_failure or self._options.show_advisories:
-            with self.bar.dodging():
-                self.stream.writeln(
-                        '\n' +
+            self._print('\n' +
                         (self._term.bold if is_failure else '') +
-                        '%s: %s' % (kind, nose_selector(test)) +
-                        (self._term.normal if is_failure else ''))  # end bold
+                        '%s: %s%s' % (kind, nose_selector(test), note) +
+                        (self._term.normal if is_failure else ''),  # end bold
+                        headline=True)
+
+    def _print(self, line, headline=False):
+        """Write a line out of the bar's way, and tell the recording, if
+        there is one."""
+        if self._recording is not None:
+            if headline:
+                self._recording.headline(line + '\n')
+            else:
+                self._recording.printed(line + '\n')
+        with self.bar.dodging():
+            self.stream.writeln(line)
 
-    def _recordAndPrintHeadline(self, test, error_class, artifact):
-        """Record that an error-like thing occurred, and print a summary.
+    def _recordError(self, test, error_class, artifact, exception=None):
+        """Record that an error-like thing occurred.
 
-        Store ``artifact`` with the record.
+        Store ``artifact`` with the record. Pass ``exception`` along to
+        ``_noteOutcome()``.
 
-        Return whether the test result is any sort of failure.
+        Return the kind of error, like "ERROR" or "SKIP", and whether the test
+        result is any sort of failure.
 
         """
         # We duplicate the errorclass handling from super rather than calling
@@ -125,15 +308,19 @@ class ProgressiveResult(TextTestResult):
                     test.passed = False
                 storage.append((test, artifact))
                 is_error_class = True
+                kind, is_class_failure = label, is_failure
         if not is_error_class:
+            # As unittest's TestResult.addError() would:
+            if getattr(self, 'failfast', False):
+                self.stop()
             self.errors.append((test, artifact))
+            self._mirrorOutput = True
             test.passed = False
+            kind = 'ERROR'
 
-        is_any_failure = not is_error_class or is_failure
-        self._printHeadline(label if is_error_class else 'ERROR',
-                            test,
-                            is_failure=is_any_failure)
-        return is_any_failure
+        is_any_failure = not is_error_class or is_class_failure
+        self._noteOutcome(kind.lower(), exception, is_any_failure)
+        return kind, is_any_failure
 
     def addSkip(self, test, reason):
         """Catch skipped tests in Python 2.7 and above.
@@ -145,27 +332,58 @@ class ProgressiveResult(TextTestResult):
         :arg reason: Text describing why the test was skipped
 
         """
-        self._recordAndPrintHeadline(test, SkipTest, reason)
+        kind, is_failure = self._recordError(test, SkipTest, reason, reason)
+        self._printHeadline(kind, test, is_failure=is_failure)
         # Python 2.7 users get a little bonus: the reason the test was skipped.
         if isinstance(reason, Exception):
             reason = getattr(reason, 'message', None) or getattr(
                 reason, 'args')[0]
         if reason and self._options.show_advisories:
-            with self.bar.dodging():
-                self.stream.writeln(reason)
+            self._print(reason)
 
     def addError(self, test, err):
-        # We don't read this, but some other plugin might conceivably expect it
-        # to be there:
-        excInfo = self._exc_info_to_string(err, test)
-        is_failure = self._recordAndPrintHeadline(test, err[0], excInfo)
+        # We don't read the record we store, but some other plugin might
+        # conceivably expect it to be there. It turns into the string
+        # unittest would have stored if asked.
+        record = self._record(test, err)
+        kind, is_failure = self._recordError(test, err[0], record, record)
         if is_failure:
-            self._printTraceback(test, err)
+            self._printFailure(kind, test, err, record)
+        else:
+            self._printHeadline(kind, test, is_failure=False)
+        if test is not self._test and self._events is not None:
+            # A module's or class's fixture broke. No test was started, so
+            # stopTest() won't report it.
+            self._events.test_finished(_context_selector(test),
+                                       0.0,
+                                       self._outcome)
+        self._releaseFrames(err)
 
     def addFailure(self, test, err):
-        super(ProgressiveResult, self).addFailure(test, err)
-        self._printHeadline('FAIL', test)
-        self._printTraceback(test, err)
+        # What unittest's TestResult.addFailure() does, but storing a record
+        # rather than a string:
+        if getattr(self, 'failfast', False):
+            self.stop()
+        record = self._record(test, err)
+        self.failures.append((test, record))
+        self._mirrorOutput = True
+        self._noteOutcome('fail', record, True)
+        self._printFailure('FAIL', test, err, record)
+        self._releaseFrames(err)
+
+    def close(self):
+        """Let go of the files kept open for the run, once every plugin has
+        had its chance to look at the results.
+
+        The storm file is closed here too, in case the run was interrupted or
+        some other plugin printed the summary instead of us.
+
+        """
+        for records in self.errors, self.failures:
+            if isinstance(records, SpillingList):
+                records.close()
+        if self._storm_file is not None:
+            self._storm_file.close()
 
     def printSummary(self, start, stop):
         """As a final summary, print number of tests, broken down by result."""
@@ -196,6 +414,12 @@ class ProgressiveResult(TextTestResult):
                         is_failure)
                         for (storage, label, is_failure) in
                             self.errorClasses.values() if len(storage)])
+        if self._events is not None:
+            self._events.write(event='summary',
+                               counts=dict((type, number) for
+                                           type, number, _ in counts),
+                               duration=stop - start,
+                               successful=self.wasSuccessful())
         summary = (', '.join(renderResultType(*a) for a in counts) +
                    ' in %.1fs' % (stop - start))
 
@@ -207,3 +431,38 @@ class ProgressiveResult(TextTestResult):
         if self.wasSuccessful():
             self.stream.write(self._term.bold_green('OK!  '))
         self.stream.writeln(summary)
+
+        if self._options.slowest and self.timings:
+            self.stream.writeln()
+            self.stream.writeln(self._term.bold('Slowest:'))
+            for label, duration in self.timings.slowest(self._options.slowest):
+                self.stream.writeln('%9.3fs  %s' % (duration, label))
+
+        if self._storm_file is not None:
+            self._storm_file.close()
+            self.stream.writeln()
+            self.stream.writeln('%s traceback%s written to %s' %
+                                (self._storm_count,
+                                 ' was' if self._storm_count == 1 else 's were',
+                                 self._storm_path))
+
+        repeated = self._groups.repeated() if self._groups else []
+        if repeated:
+            self.stream.writeln()
+            self.stream.writeln(self._term.bold('Repeated failures:'))
+            for group in repeated:
+                self.stream.writeln('%9d  #%-4s %s' % (group.count,
+                                                      group.number,
+                                                      group.exception))
+
+
+def _context_selector(suite):
+    """Return a selector-like name for the fixture of a ``ContextSuite`` that
+    raised, like ``pkg.mod:setup`` or ``pkg.mod:Class.teardown``."""
+    context = getattr(suite, 'context', None)
+    if context is None:
+        return nose_selector(suite)
+    name = context_name(context)
+    return '%s%s%s' % (name,
+                       '.' if ':' in name else ':',
+                       getattr(suite, 'error_context', None) or 'setup')
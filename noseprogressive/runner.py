@@ -8,10 +8,14 @@ from noseprogressive.result import ProgressiveResult
 class ProgressiveRunner(nose.core.TextTestRunner):
     """Test runner that makes a lot less noise than TextTestRunner"""
 
-    def __init__(self, cwd, totalTests, stream, **kwargs):
+    def __init__(self, cwd, totalTests, stream, history=None, events=None,
+                 recording=None, **kwargs):
         super(ProgressiveRunner, self).__init__(stream, **kwargs)
         self._cwd = cwd
         self._totalTests = totalTests
+        self._history = history
+        self._events = events
+        self._recording = recording
 
     def _makeResult(self):
         """Return a Result that doesn't print dots.
@@ -24,7 +28,10 @@ class ProgressiveRunner(nose.core.TextTestRunner):
         return ProgressiveResult(self._cwd,
                                  self._totalTests,
                                  self.stream,
-                                 config=self.config)
+                                 config=self.config,
+                                 history=self._history,
+                                 events=self._events,
+                                 recording=self._recording)
 
     def run(self, test):
         "Run the given test case or test suite...quietly."
@@ -38,27 +45,33 @@ class ProgressiveRunner(nose.core.TextTestRunner):
             self.stream = wrapped
 
         result = self._makeResult()
-        startTime = time()
         try:
-            test(result)
-        except KeyboardInterrupt:
-            # we need to ignore these exception to not
-            # show traceback when user intentionally
-            # interrupted test suite execution, and
-            # to output some reasonable results on
-            # already passed and failed tests.
-            pass
-        stopTime = time()
+            startTime = time()
+            try:
+                test(result)
+            except KeyboardInterrupt:
+                # we need to ignore these exception to not
+                # show traceback when user intentionally
+                # interrupted test suite execution, and
+                # to output some reasonable results on
+                # already passed and failed tests.
+                pass
+            stopTime = time()
 
-        # We don't care to hear about errors again at the end; we take care of
-        # that in result.addError(), while the tests run.
-        # result.printErrors()
-        #
-        # However, we do need to call this one useful line from
-        # nose.result.TextTestResult's implementation of printErrors() to make
-        # sure other plugins get a chance to report:
-        self.config.plugins.report(self.stream)
+            # We don't care to hear about errors again at the end; we take
+            # care of that in result.addError(), while the tests run.
+            # result.printErrors()
+            #
+            # However, we do need to call this one useful line from
+            # nose.result.TextTestResult's implementation of printErrors() to
+            # make sure other plugins get a chance to report. Get the bar out
+            # of the way first, and keep its catch-up timer from painting it
+            # back over their reports:
+            result.bar.erase()
+            self.config.plugins.report(self.stream)
 
-        result.printSummary(startTime, stopTime)
-        self.config.plugins.finalize(result)
+            result.printSummary(startTime, stopTime)
+            self.config.plugins.finalize(result)
+        finally:
+            result.close()
         return result
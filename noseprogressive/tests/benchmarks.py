@@ -0,0 +1,373 @@
+"""Benchmarks of how much time nose-progressive adds to a test run
+
+Run them with ``python -m noseprogressive.tests.benchmarks``. They aren't
+tests, so nose doesn't collect them.
+
+There are three kinds:
+
+End-to-end
+    Synthetic test trees---trivial tests, chatty ones, failing ones, failures
+    from deep in the stack, and generated ones---are run by plain nose and by
+    nose with nose-progressive, and the difference is reported per test.
+Components
+    ``ProgressiveResult``, ``ProgressBar``, ``StreamWrapper``, and
+    ``format_traceback()`` are timed in isolation, per call.
+Replays
+    A recording made with ``--progressive-record`` is played back through
+    ``ProgressBar`` and ``TracebackFormatter`` on a headless terminal, and the
+    time per event and the bytes of output are reported. This shows how a
+    change to rendering does on the output of a real suite, without running
+    it.
+
+Each run's numbers are appended to a JSON file, along with the Python version
+and the git revision, and compared with those of the previous run, so a
+regression shows up as a jump.
+
+"""
+
+from __future__ import with_statement
+from datetime import datetime
+from optparse import OptionParser
+import os
+from os.path import abspath, basename, dirname, join
+import re
+from shutil import rmtree
+import subprocess
+import sys
+from tempfile import mkdtemp
+from timeit import Timer
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+try:
+    from unittest.runner import _WritelnDecorator  # Python 2.7+
+except ImportError:
+    from unittest import _WritelnDecorator
+
+from blessings import Terminal
+from nose.case import FunctionTestCase, Test
+from nose.config import Config
+from nose.util import src
+
+from noseprogressive.bar import ProgressBar
+from noseprogressive.plugin import ProgressivePlugin
+from noseprogressive.recording import load, replay
+from noseprogressive.result import ProgressiveResult
+from noseprogressive.tracebacks import extract_relevant_tb, format_traceback
+from noseprogressive.utils import load_json, save_json
+from noseprogressive.wrapping import StreamWrapper
+
+
+TESTS_PER_MODULE = 500
+
+# Module bodies for each kind of synthetic tree. %(index)s is the module
+# number; each ``test`` line is repeated once per test, with %(test)s the
+# test number.
+TREES = {
+    'trivial': ('', 'def test_%(test)s():\n    pass\n'),
+    'chatty': ('',
+               'def test_%(test)s():\n' +
+               "    print('Some chatter from a test, %(test)s')\n" * 5),
+    'failing': ('', 'def test_%(test)s():\n    assert False, "broken"\n'),
+    'deep': ('def recurse(depth):\n'
+             '    if depth:\n'
+             '        return recurse(depth - 1)\n'
+             '    raise ValueError("bottomed out")\n',
+             'def test_%(test)s():\n    recurse(30)\n'),
+    'generators': ('def check(x):\n    pass\n',
+                   # 100 tests each
+                   'def test_%(test)s():\n'
+                   '    for i in range(100):\n'
+                   '        yield check, i\n'),
+}
+
+# How many tests each tree has at a scale of 1:
+SIZES = {'trivial': 10000,
+         'chatty': 2000,
+         'failing': 2000,
+         'deep': 1000,
+         'generators': 10000}
+
+# Extra nose args, say to keep chatter from being captured:
+NOSE_ARGS = {'chatty': ['-s']}
+
+# Runs nose, with our plugin available, from wherever this checkout is:
+RUNNER = ('import sys; sys.path.insert(0, %r); import nose; '
+          'from noseprogressive import ProgressivePlugin; '
+          'nose.main(addplugins=[ProgressivePlugin()])' %
+          dirname(dirname(dirname(abspath(__file__)))))
+
+
+def write_tree(root, kind, count):
+    """Write a package of ``count`` tests of the given kind under ``root``,
+    and return the package's path."""
+    package = join(root, 'bench_%s' % kind)
+    os.mkdir(package)
+    open(join(package, '__init__.py'), 'w').close()
+    header, test = TREES[kind]
+    if kind == 'generators':
+        count //= 100
+    for index, start in enumerate(range(0, count, TESTS_PER_MODULE)):
+        with open(join(package, 'test_%s.py' % index), 'w') as module:
+            module.write(header)
+            for number in range(start, min(start + TESTS_PER_MODULE, count)):
+                module.write(test % {'test': number})
+    return package
+
+
+class RunFailed(Exception):
+    """nose crashed, or otherwise didn't get through the tests"""
+
+
+# A traceback that isn't part of a test's report, which nose puts right under
+# a line of dashes. Tracebacks in nose-progressive's reports have no header.
+_STRAY_TRACEBACK = re.compile(r'(?<!-{70}\n)^Traceback \(most recent call '
+                              r'last\):$', re.MULTILINE)
+
+
+def _run_nose(args, cwd):
+    """Run nose in a subprocess, and return how long it took.
+
+    Raise ``RunFailed`` if it exits with anything but a pass or a fail, or
+    prints a traceback of its own, since the time of a run that crashed
+    partway says nothing about overhead.
+
+    """
+    runs = []
+
+    def run():
+        process = subprocess.Popen([sys.executable, '-c', RUNNER] + args,
+                                   cwd=cwd,
+                                   stdout=devnull,
+                                   stderr=subprocess.PIPE)
+        output = process.communicate()[1]
+        runs.append((process.returncode, output))
+
+    with open(os.devnull, 'w') as devnull:
+        elapsed = Timer(run).timeit(1)
+    returncode, output = runs[0]
+    output = output.decode('utf-8', 'replace')
+    if returncode not in (0, 1) or _STRAY_TRACEBACK.search(output):
+        raise RunFailed('nose %s exited with %s:\n%s' %
+                        (' '.join(args), returncode, output[-2000:]))
+    return elapsed
+
+
+def end_to_end(kind, count, repeat):
+    """Return the time nose-progressive adds per test, in microseconds, to
+    a run of ``count`` tests of the given kind, taking the best of
+    ``repeat`` runs with and without it."""
+    root = mkdtemp(prefix='noseprogressive-bench-')
+    try:
+        package = write_tree(root, kind, count)
+        args = NOSE_ARGS.get(kind, []) + [package]
+        plain = min(_run_nose(args, root) for _ in range(repeat))
+        progressive = min(_run_nose(['--with-progressive',
+                                     '--progressive-with-bar'] + args,
+                                    root)
+                          for _ in range(repeat))
+    finally:
+        rmtree(root)
+    return (progressive - plain) / count * 1e6
+
+
+class BenchTerminal(Terminal):
+    """A terminal of a fixed size, for a stream that isn't a tty"""
+    @property
+    def width(self):
+        return 80
+
+    @property
+    def height(self):
+        return 24
+
+
+def _config(*args):
+    """Return a nose config with nose-progressive's options parsed from
+    ``args``."""
+    parser = OptionParser()
+    ProgressivePlugin().options(parser, env={})
+    config = Config()
+    config.options, _ = parser.parse_args(list(args))
+    return config
+
+
+def _trivial():
+    pass
+
+
+def _deep_exc_info(depth=30):
+    def recurse(depth):
+        if depth:
+            return recurse(depth - 1)
+        raise ValueError('bottomed out')
+    try:
+        recurse(depth)
+    except ValueError:
+        return sys.exc_info()
+
+
+def _per_call(function, number):
+    """Return the best of 3 timings of ``function``, in microseconds per
+    call."""
+    return min(Timer(function).repeat(3, number)) / number * 1e6
+
+
+def components(number):
+    """Return a dict of the time per call, in microseconds, of the parts of
+    nose-progressive that run for each test, each called ``number`` times."""
+    results = {}
+
+    for name, args in [('ProgressiveResult passing test', []),
+                       # Timings are kept only when something needs them:
+                       ('ProgressiveResult passing test, with '
+                        '--progressive-slowest', ['--progressive-slowest=10'])]:
+        config = _config('--progressive-with-bar', *args)
+        result = ProgressiveResult('', number * 3,
+                                   _WritelnDecorator(StringIO()),
+                                   config=config)
+        result.bar = ProgressBar(number * 3,
+                                 BenchTerminal(kind='xterm-256color',
+                                               stream=StringIO(),
+                                               force_styling=True))
+        test = Test(FunctionTestCase(_trivial), config=config)
+
+        def run_test():
+            result.startTest(test)
+            result.addSuccess(test)
+            result.stopTest(test)
+        results[name] = _per_call(run_test, number)
+
+    bar = ProgressBar(number * 3,
+                      BenchTerminal(kind='xterm-256color',
+                                    stream=StringIO(),
+                                    force_styling=True))
+    counter = [0]
+
+    def update():
+        counter[0] += 1
+        bar.update('bench_pkg.test_module:test_%s' % counter[0], counter[0])
+    results['ProgressBar.update'] = _per_call(update, number)
+
+    class Plugin(object):
+        pass
+    plugin = Plugin()
+    plugin.bar = ProgressBar(1,
+                             BenchTerminal(kind='xterm-256color',
+                                           stream=StringIO(),
+                                           force_styling=True))
+    plugin.bar.update('bench_pkg.test_module:test_chatty', 0)
+    wrapper = StreamWrapper(StringIO(), plugin)
+    results['StreamWrapper.write'] = _per_call(
+        lambda: wrapper.write('Some chatter from a test\n'), number)
+
+    err = _deep_exc_info()
+    frames = extract_relevant_tb(err[2], err[0], False)
+    term = BenchTerminal(kind='xterm-256color', force_styling=True)
+    results['format_traceback, 30 frames'] = _per_call(
+        lambda: ''.join(format_traceback(frames, err[0], err[1], term=term)),
+        max(1, number // 100))
+    return results
+
+
+def replayed(path, repeat):
+    """Return the time, in microseconds per event, of the best of ``repeat``
+    replays of the recording at ``path``, and how many bytes they wrote."""
+    events = load(path)
+    streams = []
+
+    def play():
+        stream = StringIO()
+        replay(events, stream)
+        streams.append(stream)
+    best = min(Timer(play).repeat(repeat, 1))
+    return best / len(events) * 1e6, len(streams[-1].getvalue())
+
+
+def _revision():
+    """Return the git revision of this checkout, or None."""
+    try:
+        process = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'],
+                                   cwd=dirname(src(__file__)),
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        out = process.communicate()[0].strip()
+    except OSError:
+        return None
+    return out.decode('ascii') if process.returncode == 0 and out else None
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]',
+                          description='Measure the overhead of '
+                                      'nose-progressive.')
+    parser.add_option('--scale', type='float', default=1,
+                      help='Multiply the number of tests in each tree by '
+                           'this. 20 makes for 200,000 trivial tests. '
+                           'Default: 1')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='Take the best of this many runs of each tree. '
+                           'Default: 3')
+    parser.add_option('--trees', default=','.join(sorted(TREES)),
+                      help='Comma-separated trees to run. Default: all')
+    parser.add_option('--no-end-to-end', action='store_false',
+                      dest='end_to_end', default=True,
+                      help='Time only the components, not whole runs.')
+    parser.add_option('--replay', metavar='FILE',
+                      help='Time replays of a recording made with '
+                           '--progressive-record rather than running the '
+                           'other benchmarks.')
+    parser.add_option('--calls', type='int', default=20000,
+                      help='Call each component this many times. '
+                           'Default: 20000')
+    parser.add_option('--results', default='benchmarks.json',
+                      help='JSON file to add the results to and compare '
+                           'them with. Default: benchmarks.json')
+    parser.add_option('--label', default='',
+                      help='A note to store with the results')
+    options, _ = parser.parse_args(argv)
+
+    if options.replay:
+        name = basename(options.replay)
+        per_event, size = replayed(options.replay, options.repeat)
+        results = {'replay of %s, per event' % name: per_event,
+                   'replay of %s, bytes' % name: size}
+    else:
+        results = components(options.calls)
+    if options.end_to_end and not options.replay:
+        for kind in options.trees.split(','):
+            count = int(SIZES[kind] * options.scale)
+            try:
+                results['%s tree of %s, per test' % (kind, count)] = (
+                    end_to_end(kind, count, options.repeat))
+            except RunFailed:
+                sys.stderr.write('The %s tree of %s tests failed to run, so '
+                                 'no results were saved.\n' % (kind, count))
+                raise
+
+    path = abspath(options.results)
+    history = load_json(path) or []
+    previous = history[-1]['results'] if history else {}
+    width = max(len(name) for name in results)
+    for name in sorted(results):
+        line = '%-*s  %10.2f %s' % (width, name, results[name],
+                                     'B' if name.endswith('bytes') else 'us')
+        if previous.get(name):
+            line += '  (was %.2f, %+.0f%%)' % (
+                previous[name],
+                (results[name] / previous[name] - 1) * 100)
+        print(line)
+
+    history.append({'time': datetime.now().isoformat(),
+                    'python': sys.version.split()[0],
+                    'revision': _revision(),
+                    'label': options.label,
+                    'scale': options.scale,
+                    'results': results})
+    if not save_json(path, history):
+        sys.stderr.write("Couldn't save results to %s.\n" % options.results)
+
+
+if __name__ == '__main__':
+    main()
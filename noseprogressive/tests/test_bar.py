@@ -9,6 +9,7 @@ except ImportError:
 from blessings import Terminal
 from nose.tools import eq_
 
+from noseprogressive import bar as bar_module
 from noseprogressive.bar import ProgressBar
 
 
@@ -60,6 +61,23 @@ def test_color_bar_full():
                                  term.restore]))
 
 
+def test_indeterminate_bar():
+    """Assert that a bar with an unknown maximum draws a moving block."""
+    out = StringIO()
+    term = MockTerminal(kind='xterm-256color', stream=out, force_styling=True)
+    bar = ProgressBar(None, term)
+
+    bar.update('HI', 2)
+    eq_(out.getvalue(), ''.join([term.save,
+                                 term.move(24, 0),
+                                 term.bold('HI                                '),
+                                 '  ',
+                                 term.on_color(7)('  '),
+                                 term.on_color(8)('   '),
+                                 term.on_color(7)('         '),
+                                 term.restore]))
+
+
 def test_monochrome_bar():
     """Assert that the black-and-white bar draws properly when < 16 colors are available."""
     out = StringIO()
@@ -75,3 +93,136 @@ def test_monochrome_bar():
                                  term.reverse('       '),
                                  '_______',
                                  term.restore]))
+
+
+def test_frame_rate_limit():
+    """Assert that updates faster than the frame rate are painted late, not never."""
+    out = StringIO()
+    term = MockTerminal(kind='xterm-256color', stream=out, force_styling=True)
+    ticks = [1000, 1000, 1040, 1040]
+    orig_clock, bar_module.clock = bar_module.clock, lambda: ticks.pop(0)
+    try:
+        bar = ProgressBar(28, term, max_fps=0.01)  # At most every 100s
+
+        bar.update('HI', 14)  # 1000: painted
+        painted = out.getvalue()
+        bar.update('HO', 28)  # 1040: too soon to paint again
+        eq_(out.getvalue(), painted)
+        eq_(bar._catch_up_timer.interval, 60)  # Due at 1100
+
+        # Do what the timer would once the interval is up, but without
+        # waiting:
+        bar._catch_up_timer.cancel()
+        bar._catch_up()  # 1040, as far as the clock knows
+        eq_(out.getvalue()[len(painted):],
+            ''.join([term.save,
+                     term.move(24, 1),
+                     term.bold('O'),
+                     term.restore,
+                     term.save,
+                     term.move(24, 43),  # 34 cols of path, 2 spaces, 7 cells
+                     term.on_color(8)(' ' * 7),
+                     term.restore]))
+        eq_(ticks, [])
+    finally:
+        bar_module.clock = orig_clock
+
+
+def test_erase_cancels_catch_up():
+    """Assert that a late paint doesn't come after an erase, which is what
+    keeps the bar out of the summary and other plugins' reports."""
+    out = StringIO()
+    term = MockTerminal(kind='xterm-256color', stream=out, force_styling=True)
+    bar = ProgressBar(28, term, max_fps=0.01)
+
+    bar.update('HI', 14)
+    bar.update('HO', 28)  # Painted late
+    bar.erase()
+    erased = out.getvalue()
+    # Even if the timer fired just before it was cancelled:
+    bar._catch_up()
+    eq_(out.getvalue(), erased)
+
+
+def test_differential_update():
+    """Assert that only the parts of the line that changed get repainted."""
+    out = StringIO()
+    term = MockTerminal(kind='xterm-256color', stream=out, force_styling=True)
+    bar = ProgressBar(28, term)
+
+    bar.update('HI', 14)
+    painted = out.getvalue()
+    bar.update('HO', 16)
+    eq_(out.getvalue()[len(painted):],
+        ''.join([term.save,
+                 term.move(24, 1),
+                 term.bold('O'),
+                 term.restore,
+                 term.save,
+                 term.move(24, 43),  # 34 cols of path, 2 spaces, 7 cells
+                 term.on_color(8)(' '),
+                 term.restore]))
+
+    # Nothing changed, so nothing gets written:
+    painted = out.getvalue()
+    bar.update('HO', 16)
+    eq_(out.getvalue(), painted)
+
+
+def test_resized_between_paints():
+    """Assert that the whole line is repainted if it's changed width since
+    the last paint, rather than diffed against what's no longer there."""
+    out = StringIO()
+    term = MockTerminal(kind='xterm-256color', stream=out, force_styling=True)
+    bar = ProgressBar(28, term)
+
+    bar.update('HI', 14)
+    painted = out.getvalue()
+    bar.cols = 60  # as if a SIGWINCH came in without a repaint after it
+    bar.update('HO', 16)
+    eq_(out.getvalue()[len(painted):],
+        ''.join([term.save, term.move(24, 0), bar.last, term.restore]))
+    assert bar.last.startswith(term.bold('HO' + ' ' * 42))  # 60 - 14 - 2 - 2
+
+
+def test_buffered_writes():
+    """Assert that buffered writes come out in order, in a single dodge."""
+    out, other = StringIO(), StringIO()
+    term = MockTerminal(kind='xterm-256color', stream=out, force_styling=True)
+    bar = ProgressBar(28, term, buffer_writes=True)
+    bar.update('HI', 14)
+    painted = out.getvalue()
+
+    bar.write(other, 'one\n')
+    bar.write(out, 'two\n')
+    bar.write(other, 'three\n')
+    eq_(out.getvalue(), painted)  # Nothing yet
+    eq_(other.getvalue(), '')
+
+    bar.flush_writes()
+    eq_(other.getvalue(), 'one\nthree\n')
+    written = out.getvalue()[len(painted):]
+    eq_(written.count(term.clear_eol), 1)  # Erased just once
+    assert written.index(term.clear_eol) < written.index('two\n')
+
+
+def test_status_area():
+    """Assert that the status area sits between the path and the graph and is
+    repainted only where it changes."""
+    out = StringIO()
+    term = MockTerminal(kind='xterm-256color', stream=out, force_styling=True)
+    bar = ProgressBar(28, term, status_width=6)
+
+    bar.update('HI', 14, '5/s')
+    eq_(out.getvalue(), ''.join([term.save,
+                                 term.move(24, 0),
+                                 term.bold('HI' + ' ' * 24),
+                                 '  5/s     ',
+                                 term.on_color(8)(' ' * 7),
+                                 term.on_color(7)(' ' * 7),
+                                 term.restore]))
+
+    painted = out.getvalue()
+    bar.update('HI', 14, '6/s')
+    eq_(out.getvalue()[len(painted):],
+        ''.join([term.save, term.move(24, 28), '6', term.restore]))
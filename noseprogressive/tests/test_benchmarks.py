@@ -0,0 +1,55 @@
+"""Tests to keep the benchmarks from rotting"""
+
+from os import listdir
+from os.path import basename
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from nose.tools import assert_raises, eq_
+
+from noseprogressive.tests.benchmarks import (_run_nose, components,
+                                               RunFailed, write_tree)
+
+
+def test_components():
+    """Every component should get timed."""
+    eq_(sorted(components(1)), ['ProgressBar.update',
+                                'ProgressiveResult passing test',
+                                'ProgressiveResult passing test, with '
+                                '--progressive-slowest',
+                                'StreamWrapper.write',
+                                'format_traceback, 30 frames'])
+
+
+def test_write_tree():
+    """Trees should be split into modules of TESTS_PER_MODULE tests."""
+    root = mkdtemp()
+    try:
+        package = write_tree(root, 'trivial', 501)
+        eq_(basename(package), 'bench_trivial')
+        eq_(sorted(listdir(package)),
+            ['__init__.py', 'test_0.py', 'test_1.py'])
+        eq_(open(package + '/test_1.py').read(),
+            'def test_500():\n    pass\n')
+    finally:
+        rmtree(root)
+
+
+def test_run_nose():
+    """Failing tests should be timed, but a crash should be an error, not a
+    suspiciously quick run."""
+    root = mkdtemp()
+    try:
+        package = write_tree(root, 'failing', 3)
+        _run_nose([package], root)
+        _run_nose(['--with-progressive', package], root)
+        assert_raises(RunFailed, _run_nose, ['--no-such-option', package],
+                      root)
+        assert_raises(RunFailed,
+                      _run_nose,
+                      ['--with-progressive',
+                       '--progressive-record', root + '/missing/run.gz',
+                       package],
+                      root)
+    finally:
+        rmtree(root)
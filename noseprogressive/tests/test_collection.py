@@ -0,0 +1,173 @@
+"""Tests for test collection and counting"""
+
+from os import remove
+from os.path import join
+from shutil import rmtree
+import sys
+from tempfile import mkdtemp
+from unittest import TestCase, TestResult, TestSuite
+
+from nose.loader import TestLoader
+from nose.suite import LazySuite
+from nose.tools import eq_
+
+from noseprogressive.collection import (CollectionManifest, materialize,
+                                        reorder, run_selector)
+from noseprogressive.utils import load_json
+
+
+class Success(TestCase):
+    def runTest(self):
+        pass
+
+
+def test_materialize_is_repeatable():
+    """Make sure a materialized nested lazy suite can be counted and still run."""
+    def inner():
+        yield Success()
+        yield Success()
+
+    def outer():
+        yield LazySuite(inner)
+        yield TestSuite([Success()])
+
+    suite = materialize(LazySuite(outer))
+    eq_(suite.countTestCases(), 3)
+    eq_(suite.countTestCases(), 3)  # Didn't get used up the first time
+
+    result = TestResult()
+    suite(result)
+    eq_(result.testsRun, 3)
+
+
+def test_materialize_after_peek():
+    """Don't lose a test that ``__nonzero__`` already pulled off the generator."""
+    suite = LazySuite(lambda: iter([Success(), Success()]))
+    assert suite  # Peeks at the first test.
+    eq_(materialize(suite).countTestCases(), 2)
+
+
+class Named(TestCase):
+    def __init__(self, name):
+        super(Named, self).__init__()
+        self.name = name
+
+    def runTest(self):
+        pass
+
+
+def _names(suite):
+    return [test.name for test in suite]
+
+
+def test_reorder():
+    """Failed tests should go first, then by duration, without leaving their
+    suites."""
+    outcomes = {'slow': (3.0, False),
+                'fast': (1.0, False),
+                'broken': (2.0, True),
+                'other': (0.5, False)}
+    outcome = lambda test: outcomes.get(test.name)
+    inner = TestSuite([Named('slow'), Named('broken'), Named('new')])
+    suite = materialize(LazySuite(lambda: iter([Named('fast'), inner,
+                                                Named('other')])))
+
+    reorder(suite, outcome, duration_order='longest')
+    # The suite took longest in all, and "slow" stays inside it:
+    assert suite._precache[0] is inner
+    eq_(_names(inner), ['slow', 'broken', 'new'])
+    eq_(_names(suite._precache[1:]), ['fast', 'other'])
+
+    reorder(suite, outcome, failed_first=True, duration_order='shortest')
+    assert suite._precache[0] is inner
+    eq_(_names(inner), ['broken', 'new', 'slow'])
+    eq_(_names(suite._precache[1:]), ['other', 'fast'])
+
+
+def test_reorder_generated_tests():
+    """Generated tests should be found in the history by their arguments, as
+    they're recorded when they run."""
+    dir = mkdtemp()
+    try:
+        path = join(dir, 'test_gen.py')
+        with open(path, 'w') as file:
+            file.write('def test_one():\n    pass\n\n'
+                       'def test_gen():\n'
+                       '    for i in (1, 2):\n'
+                       '        yield check, i\n\n'
+                       'def check(i):\n    pass\n')
+        suite = materialize(TestLoader().loadTestsFromName(path))
+        outcomes = {'test_gen:test_gen(2,)': (1.0, True)}
+        reorder(suite, lambda test: outcomes.get(run_selector(test)),
+                failed_first=True)
+        eq_([run_selector(test) for test in _cases(suite)],
+            ['test_gen:test_gen(2,)', 'test_gen:test_gen(1,)',
+             'test_gen:test_one'])
+    finally:
+        rmtree(dir)
+        sys.modules.pop('test_gen', None)
+
+
+def _cases(suite):
+    """Return the test cases in a materialized suite, in order."""
+    cases = []
+    for test in suite:
+        if isinstance(test, TestSuite):
+            cases.extend(_cases(test))
+        else:
+            cases.append(test)
+    return cases
+
+
+class ManifestTests(TestCase):
+    """Tests for the on-disk record of per-file test counts"""
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.manifest_path = join(self.dir, 'cache', 'manifest.json')
+        self.test_file = join(self.dir, 'test_thing.py')
+        with open(self.test_file, 'w') as file:
+            file.write('def test_thing(): pass\n')
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_round_trip(self):
+        """Counts should survive being saved and loaded."""
+        manifest = CollectionManifest(self.manifest_path, 'sel')
+        eq_(manifest.count(self.test_file), None)
+        manifest.remember(self.test_file, 7)
+        manifest.save()
+        eq_(CollectionManifest(self.manifest_path, 'sel').count(self.test_file),
+            7)
+
+    def test_changed_file(self):
+        """A file that changed since it was counted has no count."""
+        manifest = CollectionManifest(self.manifest_path)
+        manifest.remember(self.test_file, 1)
+        with open(self.test_file, 'a') as file:
+            file.write('def test_other(): pass\n')
+        eq_(manifest.count(self.test_file), None)
+
+    def test_changed_selection(self):
+        """Changing the test-selection options invalidates everything."""
+        manifest = CollectionManifest(self.manifest_path, 'sel')
+        manifest.remember(self.test_file, 7)
+        manifest.save()
+        eq_(CollectionManifest(self.manifest_path, 'other').count(
+                self.test_file),
+            None)
+
+    def test_prune_missing_files(self):
+        """Files that are gone shouldn't be remembered past the next save."""
+        other_file = join(self.dir, 'test_other.py')
+        with open(other_file, 'w') as file:
+            file.write('def test_other(): pass\n')
+        manifest = CollectionManifest(self.manifest_path)
+        manifest.remember(self.test_file, 1)
+        manifest.remember(other_file, 1)
+        manifest.save()
+
+        remove(other_file)
+        manifest = CollectionManifest(self.manifest_path)
+        manifest.save()
+        eq_(sorted(load_json(self.manifest_path)['files']), [self.test_file])
@@ -0,0 +1,52 @@
+"""Tests for the JSON event log"""
+
+import json
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from time import sleep
+
+from nose.tools import eq_
+
+from noseprogressive.events import EventLog
+
+
+def test_batching():
+    """Events should be written a batch at a time, one JSON object per
+    line, and all of them by the time the log is closed."""
+    out = StringIO()
+    log = EventLog(out)
+    log.BATCH_LINES = 2
+    log.MAX_DELAY = 1000
+    log.test_started('a:test_1')
+    eq_(out.getvalue(), '')
+    log.test_finished('a:test_1', 0.5, {'event': 'fail',
+                                        'exception': 'AssertionError'})
+    eq_([json.loads(line) for line in out.getvalue().splitlines()],
+        [{'event': 'start', 'test': 'a:test_1'},
+         {'event': 'fail',
+          'test': 'a:test_1',
+          'duration': 0.5,
+          'exception': 'AssertionError'}])
+
+    log.write(event='summary')
+    eq_(len(out.getvalue().splitlines()), 2)
+    log.flush()
+    eq_(json.loads(out.getvalue().splitlines()[-1]), {'event': 'summary'})
+
+
+def test_max_delay():
+    """A lone event, like the start of a test that hangs, should go out once
+    it's MAX_DELAY old, even if nothing comes after it."""
+    out = StringIO()
+    log = EventLog(out)
+    log.MAX_DELAY = 0.01
+    log.test_started('a:test_hangs')
+    for _ in range(500):
+        if out.getvalue():
+            break
+        sleep(0.01)
+    eq_(json.loads(out.getvalue()), {'event': 'start', 'test': 'a:test_hangs'})
+    log.close()
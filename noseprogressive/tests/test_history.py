@@ -0,0 +1,92 @@
+"""Tests for remembering things between runs"""
+
+from os.path import abspath, dirname, join
+import subprocess
+import sys
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from nose.tools import eq_
+
+from noseprogressive import history as history_module
+from noseprogressive.history import RunHistory, Estimator
+
+
+def test_history_round_trip():
+    """Outcomes and complete suites' totals should survive a save, and a
+    different suite should get no total."""
+    temp_dir = mkdtemp()
+    try:
+        path = join(temp_dir, 'cache', 'history.sqlite')
+        history = RunHistory(path, 'suite')
+        eq_(history.outcome('a:test_1'), None)  # Nothing there yet
+        history.record('a:test_1', 1.5, failed=True)
+        history.record('a:test_2', 0.5)
+        history.save(complete_count=2)
+
+        history = RunHistory(path, 'suite')
+        eq_(history.outcome('a:test_1'), (1.5, True))
+        eq_(history.outcome('a:test_2'), (0.5, False))
+        eq_(history.duration('a:test_3'), None)
+        eq_(history.expected_total(2), 2.0)
+        eq_(history.expected_total(3), None)  # Suite has changed.
+        eq_(RunHistory(path, 'other').expected_total(2), None)
+    finally:
+        rmtree(temp_dir)
+
+
+def test_estimate_from_history():
+    """Remaining time should be last run's total less what's done, scaled by
+    how fast we're going."""
+    class FakeHistory(object):
+        def duration(self, selector):
+            return 2.0
+
+        def expected_total(self, count):
+            return 10.0
+
+        def record(self, selector, duration):
+            pass
+
+    estimator = Estimator(FakeHistory())
+    eq_(estimator.remaining(5), 10.0)
+    estimator.test_finished('a:test_1', 2.0)  # done_expected is now 2
+    estimator._start -= 4  # Taking twice as long as last time
+    remaining = estimator.remaining(5)
+    assert 15.9 < remaining < 16.1, remaining
+
+
+def test_estimate_from_average():
+    """Without history, assume the rest take as long as the ones so far."""
+    estimator = Estimator()
+    eq_(estimator.remaining(4), None)
+    estimator.test_finished('a:test_1', 1.0)
+    estimator._start -= 3
+    remaining = estimator.remaining(4)
+    assert 8.9 < remaining < 9.1, remaining
+    assert estimator.status(4).endswith('ETA 0:09')
+
+
+def test_without_sqlite():
+    """A Python without sqlite3 should still import the plugin and run with
+    no history."""
+    process = subprocess.Popen(
+        [sys.executable, '-c',
+         'import sys; sys.modules["sqlite3"] = None; '
+         'import noseprogressive.plugin'],
+        cwd=dirname(dirname(dirname(abspath(__file__)))),
+        stderr=subprocess.PIPE)
+    eq_(process.communicate()[1], b'')
+    eq_(process.returncode, 0)
+
+    sqlite3 = history_module.sqlite3
+    history_module.sqlite3 = None
+    temp_dir = mkdtemp()
+    try:
+        history = RunHistory(join(temp_dir, 'history.sqlite'))
+        eq_(history.outcome('a:test_1'), None)
+        history.record('a:test_1', 1.5)
+        history.save(complete_count=1)
+    finally:
+        history_module.sqlite3 = sqlite3
+        rmtree(temp_dir)
@@ -1,8 +1,28 @@
+import json
+from optparse import OptionParser
+from os import close, getcwd, remove
+from os.path import join
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+from shutil import rmtree
+import sys
+from tempfile import mkdtemp, mkstemp
+from threading import current_thread
+from time import sleep
+from types import ModuleType
+from warnings import catch_warnings, simplefilter
+from xml.dom.minidom import parse
+import unittest
 from unittest import TestCase, TestSuite
 
 from nose import SkipTest
-from nose.plugins import PluginTester
+from nose.config import Config
+from nose.plugins import Plugin, PluginTester
+from nose.plugins.isolate import IsolationPlugin
 from nose.plugins.skip import Skip
+from nose.suite import ContextSuiteFactory
 from nose.tools import eq_
 
 from noseprogressive import ProgressivePlugin
@@ -112,6 +132,197 @@ class UnitTestFrameSkippingTests(IntegrationTestCase):
         assert 'unittest' not in self.output
 
 
+class ContextErrorTests(IntegrationTestCase):
+    """Tests for errors in module and class fixtures, which nose reports
+    without ever starting a test"""
+    def setUp(self):
+        fd, self.events_path = mkstemp()
+        close(fd)
+        fd, self.junit_path = mkstemp()
+        close(fd)
+        self.args = ['--progressive-events', self.events_path,
+                     '--progressive-junit', self.junit_path]
+        super(ContextErrorTests, self).setUp()
+
+    def tearDown(self):
+        remove(self.events_path)
+        remove(self.junit_path)
+
+    def makeSuite(self):
+        module = ModuleType('broken_fixture')
+
+        def setup_module():
+            raise ValueError('no database')
+        module.setup_module = setup_module
+
+        def test_never_runs():
+            pass
+        return ContextSuiteFactory()(
+            [unittest.FunctionTestCase(test_never_runs)], context=module)
+
+    def test_events(self):
+        """The error should get an event of its own, named for the
+        fixture."""
+        with open(self.events_path) as file:
+            events = [json.loads(line) for line in file]
+        eq_([(e['event'], e.get('test')) for e in events],
+            [('error', 'broken_fixture:setup'), ('summary', None)])
+        eq_(events[0]['exception'], 'ValueError: no database')
+        assert 'setup_module' in events[0]['traceback']
+
+    def test_junit(self):
+        """The error should get a <testcase> of its own, so CI doesn't take
+        the run for a success."""
+        document = parse(self.junit_path)
+        suite = document.documentElement
+        eq_((suite.getAttribute('tests'), suite.getAttribute('errors')),
+            ('1', '1'))
+        case = suite.getElementsByTagName('testcase')[0]
+        eq_((case.getAttribute('classname'), case.getAttribute('name')),
+            ('broken_fixture', 'setup'))
+        eq_(case.getElementsByTagName('error')[0].getAttribute('type'),
+            'ValueError')
+
+
+class BackgroundCountTests(IntegrationTestCase):
+    """Tests for --progressive-background-count on a suite loaded from disk"""
+    args = ['--progressive-background-count', '--progressive-with-bar']
+    extra_plugins = []
+
+    def setUp(self):
+        self.suitepath = mkdtemp()
+        with open(join(self.suitepath, 'test_counted.py'), 'w') as file:
+            file.write('def test_a():\n    pass\n\n'
+                       'def test_b():\n    pass\n\n'
+                       'def test_c():\n    pass\n')
+        # A fresh plugin each time, so its count starts from 0:
+        self.plugin = ProgressivePlugin()
+        self.plugins = [self.plugin] + self.extra_plugins
+        super(BackgroundCountTests, self).setUp()
+        # The count may still be going if the tests finished first:
+        for _ in range(500):
+            if not self.plugin._countsPending:
+                break
+            sleep(0.01)
+
+    def tearDown(self):
+        rmtree(self.suitepath)
+        # Or the next run would find it already imported, from a path that's
+        # gone:
+        sys.modules.pop('test_counted', None)
+
+    def test_count(self):
+        """Once the count is in, the bar should have it as its max."""
+        assert '3 tests, 0 failures, 0 errors in ' in self.output
+        eq_(self.plugin._countsPending, 0)
+        eq_(self.plugin.bar.max, 3)
+
+
+class BrokenCollection(Plugin):
+    """A plugin whose collection works on the main thread but blows up on
+    any other, like the background count's"""
+    enabled = True
+    name = 'broken-collection'
+    main_thread = current_thread()
+
+    def configure(self, options, conf):
+        pass
+
+    def loadTestsFromNames(self, names, module=None):
+        if current_thread() is not self.main_thread:
+            raise RuntimeError('collection broke')
+
+
+class BackgroundCountFailureTests(BackgroundCountTests):
+    """Tests for a background count that raises"""
+    extra_plugins = [BrokenCollection()]
+
+    def test_count(self):
+        """The tests should still all run, without a deadlock, and the bar
+        should stay indeterminate rather than show a wrong max."""
+        assert '3 tests, 0 failures, 0 errors in ' in self.output
+        eq_(self.plugin._countsPending, 0)
+        assert self.plugin._countFailed
+        eq_(self.plugin.bar.max, None)
+        # Nothing should be left holding the lock:
+        assert self.plugin._countLock.acquire(False)
+        self.plugin._countLock.release()
+
+
+class BackgroundCountIsolationTests(BackgroundCountTests):
+    """Tests for background counting alongside the isolation plugin, whose
+    snapshots of sys.modules a counting thread would scramble"""
+    args = BackgroundCountTests.args + ['--with-isolation']
+    extra_plugins = [IsolationPlugin()]
+
+    def setUp(self):
+        with catch_warnings(record=True) as self.warnings:
+            simplefilter('always')
+            super(BackgroundCountIsolationTests, self).setUp()
+
+    def test_count(self):
+        """The tests should be counted up front instead, with a warning."""
+        assert '3 tests, 0 failures, 0 errors in ' in self.output
+        assert not self.plugin.conf.options.background_count
+        eq_(self.plugin.bar.max, 3)
+        eq_([str(w.message) for w in self.warnings],
+            ['Not counting tests in the background, since that would race '
+             'with the loading hooks of these plugins: isolation'])
+
+
+class LateWriter(Plugin):
+    """A plugin that writes to stderr while finalizing, after the summary but
+    before our own finalize() puts stderr back"""
+    enabled = True
+    name = 'late-writer'
+    score = ProgressivePlugin.score + 1
+
+    def configure(self, options, conf):
+        pass
+
+    def finalize(self, result):
+        sys.stderr.write('Reported late\n')
+
+
+class BufferedOutputTests(IntegrationTestCase):
+    """Tests for --progressive-buffer-output at the end of a run"""
+    args = ['--progressive-buffer-output', '--progressive-with-bar']
+    plugins = [ProgressivePlugin(), LateWriter()]
+
+    def setUp(self):
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            super(BufferedOutputTests, self).setUp()
+            self.stderr = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+
+    def makeSuite(self):
+        class Success(TestCase):
+            def runTest(self):
+                pass
+        return TestSuite([Success()])
+
+    def test_flushed(self):
+        """Output written after the summary should be out by the end of the
+        run, not left in the bar's buffer."""
+        assert self.stderr.endswith('Reported late\n')
+
+
+def test_output_paths_resolved_early():
+    """Output files should be resolved against the directory nose started
+    in, before -w changes it, except for an event log's file descriptor."""
+    parser = OptionParser()
+    plugin = ProgressivePlugin()
+    plugin.options(parser, env={})
+    options, _ = parser.parse_args(['--with-progressive',
+                                    '--progressive-events=3',
+                                    '--progressive-junit=junit.xml',
+                                    '--progressive-record=run.gz'])
+    plugin.configure(options, Config())
+    eq_((options.events_path, options.junit_path, options.record_path),
+        ('3', join(getcwd(), 'junit.xml'), join(getcwd(), 'run.gz')))
+
 # def test_slowly():
 #     """Slow down so we can visually inspect the progress bar."""
 #     from time import sleep
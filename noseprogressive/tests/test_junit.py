@@ -0,0 +1,51 @@
+"""Tests for the streaming JUnit report"""
+
+from io import BytesIO
+from xml.dom.minidom import parseString
+
+from nose.tools import eq_
+
+from noseprogressive.junit import _text, JUnitReport
+
+
+class UnclosableBytesIO(BytesIO):
+    def close(self):
+        pass
+
+
+def test_report():
+    """Test cases should stream out, and the totals should land in the
+    <testsuite> tag at the end."""
+    out = UnclosableBytesIO()
+    report = JUnitReport(out)
+    report.test_finished('a:Things.test_ok', 0.25, {'event': 'pass'})
+    report.test_finished('a:test_bad', 0.5, {
+        'event': 'fail',
+        'exception': u'AssertionError: 1 != 2 \u2603',
+        'traceback': u'Traceback...\nAssertionError: 1 != 2 <\x01>'})
+    report.test_finished('b:test_gen(1.5,)', 0, {'event': 'skip',
+                                                 'exception': 'later'})
+    assert b'<testcase' in out.getvalue()
+    report.close()
+
+    suite = parseString(out.getvalue()).documentElement
+    eq_([suite.getAttribute(a) for a in
+         ['tests', 'failures', 'errors', 'skip', 'time']],
+        ['3', '1', '0', '1', '0.750'])
+    cases = suite.getElementsByTagName('testcase')
+    eq_([(c.getAttribute('classname'), c.getAttribute('name')) for c in cases],
+        [('a.Things', 'test_ok'), ('a', 'test_bad'), ('b', 'test_gen(1.5,)')])
+    failure = cases[1].getElementsByTagName('failure')[0]
+    eq_(failure.getAttribute('type'), 'AssertionError')
+    eq_(failure.firstChild.data,
+        u'Traceback...\nAssertionError: 1 != 2 <?>')
+    eq_(cases[2].getElementsByTagName('skipped')[0].getAttribute('message'),
+        'later')
+
+
+def test_text():
+    """Characters XML can't hold should be replaced, but not characters beyond
+    the BMP, even where they're stored as surrogate pairs."""
+    eq_(_text(b'caf\xc3\xa9 \x01'), u'caf\xe9 ?')
+    eq_(_text(u'\U0001f600 \u2603'), u'\U0001f600 \u2603')
+    eq_(_text(u'lone \udc00'), u'lone ?')
@@ -0,0 +1,161 @@
+"""Tests for multiprocess support"""
+
+from optparse import OptionParser
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+try:
+    from unittest.runner import _WritelnDecorator  # Python 2.7+
+except ImportError:
+    from unittest import _WritelnDecorator
+
+from nose.config import Config
+from nose.tools import eq_
+
+from noseprogressive.bar import NullProgressBar
+from noseprogressive.parallel import (ParallelProgress, WorkerResult,
+                                      _WorkerResultMaker)
+from noseprogressive.plugin import ProgressivePlugin
+
+
+class FakeBar(object):
+    GRAPH_WIDTH = 14
+    cols = 44  # leaves 28 columns for the test path
+    status_width = 0
+    max = 10
+
+    def __init__(self):
+        self.updates = []
+
+    def update(self, test_path, number, status=None):
+        self.updates.append((test_path, number) if status is None else
+                            (test_path, number, status))
+
+
+class FakeListener(object):
+    """A stand-in for a ``RunHistory``, an ``EventLog``, and an
+    ``Estimator``, which remembers what it was told"""
+    def __init__(self, broken=False):
+        self.calls = []
+        self._broken = broken
+
+    def record(self, *args):
+        if self._broken:
+            self._broken = False
+            raise ValueError('database is locked')
+        self.calls.append(('record',) + args)
+
+    def test_started(self, selector):
+        self.calls.append(('started', selector))
+
+    def test_finished(self, *args):
+        self.calls.append(('finished',) + args)
+
+    def status(self, total):
+        return '%s done of %s' % (len(self.calls), total)
+
+
+def test_combined_progress():
+    """Starts from all workers should add up on one bar, and the parent's
+    count of finished tests should never move it backward."""
+    bar = FakeBar()
+    progress = ParallelProgress(2)
+    progress.start(bar)
+    progress._queue.put(('start', 100, 'a:test_1'))
+    progress._queue.put(('start', 200, 'b:test_1'))
+    progress.tests_finished(1)  # behind; ignored
+    progress.tests_finished(4)  # some ran without telling us
+    progress.stop()
+    eq_(bar.updates, [('a:test_1', 1), ('b:test_1', 2), ('b:test_1', 4)])
+
+
+def test_worker_status():
+    """Each worker should get a slot of its own, and a new worker should
+    displace the one we've heard from least recently."""
+    bar = FakeBar()
+    progress = ParallelProgress(2, show_workers=True)
+    progress.start(bar)
+    progress._queue.put(('start', 100, 'a:test_1'))
+    progress._queue.put(('start', 200, 'b:test_very_long_name'))
+    progress._queue.put(('start', 100, 'a:test_2'))
+    progress._queue.put(('start', 300, 'c:test_1'))
+    progress.stop()
+    eq_([path for path, number in bar.updates],
+        ['a:test_1    ',
+         'a:test_1     | ry_long_name',
+         'a:test_2     | ry_long_name',
+         'a:test_2     | c:test_1    '])
+
+
+def test_worker_result_maker():
+    """nose should get, as the class of a worker's result, something that
+    makes ``WorkerResult``s with the run's cwd and progress."""
+    progress = ParallelProgress(2, history=object())
+    parser = OptionParser()
+    ProgressivePlugin().options(parser, env={})
+    config = Config()
+    config.options, _ = parser.parse_args([])
+
+    make_result = _WorkerResultMaker('/proj', progress).__class__
+    result = make_result(_WritelnDecorator(StringIO()), descriptions=1,
+                         verbosity=1, config=config)
+    assert isinstance(result, WorkerResult)
+    eq_(result._cwd, '/proj')
+    assert result._history is progress
+    assert isinstance(result.bar, NullProgressBar)
+
+
+def test_pickled_progress():
+    """A worker that isn't forked should get the queue, and whether there's a
+    history and an event log, but none of the parent's machinery."""
+    progress = ParallelProgress(2, history=object())
+    progress.start(FakeBar())
+    try:
+        state = progress.__getstate__()
+    finally:
+        progress.stop()
+    assert state['_queue'] is progress._queue
+    eq_((state['_thread'], state['history'], state['events']),
+        (None, True, None))
+
+
+def test_null_bar():
+    """With no bar to show, reports should still get to the history and the
+    event log, even when showing each worker's status."""
+    history, events = FakeListener(), FakeListener()
+    progress = ParallelProgress(2, show_workers=True, history=history,
+                                events=events)
+    progress.start(NullProgressBar())
+    progress.test_started('a:test_1')
+    progress.test_finished('a:test_1', 0.5, {'event': 'pass'})
+    progress.record('a:test_1', 0.5, False)
+    progress.stop()
+    eq_(events.calls, [('started', 'a:test_1'),
+                       ('finished', 'a:test_1', 0.5, {'event': 'pass'})])
+    eq_(history.calls, [('record', 'a:test_1', 0.5, False)])
+
+
+def test_bad_report():
+    """A report that can't be passed along shouldn't stop the rest."""
+    history = FakeListener(broken=True)
+    progress = ParallelProgress(2, history=history)
+    progress.start(FakeBar())
+    progress.record('a:test_1', 0.5, False)
+    progress.record('a:test_2', 0.25, True)
+    progress.stop()
+    eq_(history.calls, [('record', 'a:test_2', 0.25, True)])
+
+
+def test_eta():
+    """Durations should get to the estimator, and its status to the bar."""
+    bar, estimator = FakeBar(), FakeListener()
+    progress = ParallelProgress(2)
+    progress.start(bar, estimator)
+    progress._queue.put(('start', 100, 'a:test_1'))
+    progress.record('a:test_1', 0.5, False)
+    progress._queue.put(('start', 100, 'a:test_2'))
+    progress.stop()
+    eq_(estimator.calls, [('finished', 'a:test_1', 0.5)])
+    eq_(bar.updates, [('a:test_1', 1, '0 done of 10'),
+                      ('a:test_2', 2, '1 done of 10')])
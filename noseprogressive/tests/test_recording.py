@@ -0,0 +1,116 @@
+"""Tests for recording and replaying what the bar and formatter show"""
+
+from os import close, getpid, kill, remove
+from signal import getsignal, signal, SIGWINCH
+from tempfile import mkstemp
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+from traceback import format_exception_only
+
+from nose.tools import eq_
+
+from noseprogressive.bar import NullProgressBar
+from noseprogressive.recording import (_exception, load, Recording,
+                                       RecordingBar, replay)
+
+
+SETUP = dict(cwd='/tmp',
+             max=None,
+             cols=80,
+             lines=24,
+             status_width=0,
+             filled_color=8,
+             empty_color=7,
+             buffer_writes=False,
+             function_color=12,
+             dim_color=8,
+             editor='vi',
+             editor_shortcut_template='  {path}:{line_number}',
+             source_context=0)
+
+
+class FakeTerminal(object):
+    width = 100
+    height = None
+
+
+def test_round_trip():
+    """Events should come back from a recording as they went in, and replay
+    into output."""
+    previous = getsignal(SIGWINCH)
+    fd, path = mkstemp(suffix='.gz')
+    close(fd)
+    try:
+        recording = Recording.open(path)
+        recording.setup(**SETUP)
+        bar = RecordingBar(NullProgressBar(), recording, FakeTerminal())
+        bar.max = 2
+        bar.update('a:test_chatty', 1)
+        out = StringIO()
+        bar.write(out, 'chatter\n')
+        eq_(out.getvalue(), 'chatter\n')
+        recording.headline(u'\nFAIL: a:test_bad\n')
+        recording.traceback([('/tmp/a.py', 3, 'test_bad', None),
+                             ('/tmp/b.py', 4, 'helper', b'caf\xe9')],
+                            'ValueError: no\nreally\n')
+        bar._handle_winch()
+        bar.erase()
+        recording.close()
+
+        events = load(path)
+        eq_(events[1:], [['max', 2],
+                         ['start', 'a:test_chatty', 1, ''],
+                         ['write', 'chatter\n'],
+                         ['headline', '\nFAIL: a:test_bad\n'],
+                         ['traceback',
+                          [['/tmp/a.py', 3, 'test_bad', None],
+                           ['/tmp/b.py', 4, 'helper', u'caf\ufffd']],
+                          'ValueError: no\nreally\n'],
+                         ['resize', 100, 24],
+                         ['erase']])
+
+        out = StringIO()
+        replay(events, out)
+        output = out.getvalue()
+        assert 'a:test_chatty' in output
+        assert 'chatter\n' in output
+        assert 'FAIL: a:test_bad' in output
+        assert '  a.py:3\n' in output
+        assert u'caf\ufffd' in output
+        assert output.index('chatter') < output.index('ValueError: no\nreally')
+    finally:
+        signal(SIGWINCH, previous)
+        remove(path)
+
+
+def test_exception():
+    """Replayed exceptions should format the way the recorded ones did."""
+    for text in ['ValueError: no\n',
+                 'AssertionError: Lists differ\n\nFirst one\n',
+                 'pkg.mod.Error: oops\n',
+                 'StopIteration\n']:
+        eq_(''.join(format_exception_only(*_exception(text))), text)
+
+
+def test_winch_after_close():
+    """Once the recording is closed, a resize should put back the handler the
+    bar took over, rather than write to the closed file."""
+    previous = getsignal(SIGWINCH)
+    resizes = []
+    signal(SIGWINCH, lambda *args: resizes.append(args))
+    fd, path = mkstemp(suffix='.gz')
+    close(fd)
+    try:
+        recording = Recording.open(path)
+        handler = getsignal(SIGWINCH)
+        RecordingBar(NullProgressBar(), recording, FakeTerminal())
+        recording.close()
+        kill(getpid(), SIGWINCH)
+        eq_(getsignal(SIGWINCH), handler)
+        eq_(len(resizes), 1)
+        recording.resize(80, 24)  # ignored
+    finally:
+        signal(SIGWINCH, previous)
+        remove(path)
@@ -0,0 +1,121 @@
+"""Tests for failure records"""
+
+import pickle
+import sys
+
+from nose.tools import eq_
+from nose.util import src
+
+from noseprogressive.records import (FailureGroups, FailureRecord,
+                                     release_frames, SpillingList)
+
+
+def _exc_info():
+    try:
+        big = [0] * 1000
+        raise ValueError('bad %s' % len(big))
+    except ValueError:
+        return sys.exc_info()
+
+
+class Test(object):
+    """A test whose frame is _exc_info()'s"""
+    failureException = AssertionError
+
+    def address(self):
+        return src(__file__), __name__, '_exc_info'
+
+
+def test_record():
+    """A record should render like a unittest traceback and survive the trip
+    to the multiprocess plugin's parent process."""
+    err = _exc_info()
+    record = FailureRecord.from_exc_info('a:test_thing', err, Test())
+    release_frames(err[2])
+    eq_(record.exception_type, 'ValueError')
+    eq_(record.exception, 'ValueError: bad 1000\n')
+    eq_(record.frames[record.test_frame_index][2], '_exc_info')
+    eq_([text for _, _, _, text in record.frames], [None])  # not read yet
+    text = str(record)
+    assert text.startswith('Traceback (most recent call last):\n')
+    assert "raise ValueError('bad %s' % len(big))" in text
+    assert text.endswith('ValueError: bad 1000\n')
+
+    # unittest promises a string, so it should act like one:
+    assert 'ValueError: bad 1000' in record
+    eq_(record.splitlines()[-1], 'ValueError: bad 1000')
+    eq_(len(record), len(text))
+    eq_('> ' + record, '> ' + text)
+
+    copy = pickle.loads(pickle.dumps(record, 2))
+    eq_(str(copy), text)
+    eq_(copy.selector, 'a:test_thing')
+
+
+def test_release_frames():
+    """Finished frames should lose their locals where Python allows it."""
+    err = _exc_info()
+    frame = err[2].tb_frame  # _exc_info()'s
+    release_frames(err[2])
+    if hasattr(frame, 'clear'):
+        eq_(frame.f_locals, {})
+    else:
+        assert 'big' in frame.f_locals
+
+
+def test_spilling_list():
+    """Items past the limit should go to disk, come back with stand-ins for
+    their tests, and count all the same."""
+    class Test(object):
+        def __init__(self, name):
+            self.name = name
+
+        def id(self):
+            return 'a.' + self.name
+
+        def shortDescription(self):
+            return None
+
+        def __str__(self):
+            return 'a:' + self.name
+
+    items = SpillingList(2)
+    items.extend((Test('test_%s' % i), 'oops %s' % i) for i in range(4))
+    items.append(('b:test_4', 'oops 4'))  # as the multiprocess plugin does
+    eq_(len(items), 5)
+    eq_(len(items._memory), 2)
+    assert isinstance(items[1][0], Test)  # still in memory
+    eq_([(str(test), artifact) for test, artifact in items[1:]],
+        [('a:test_1', 'oops 1'),
+         ('a:test_2', 'oops 2'),
+         ('a:test_3', 'oops 3'),
+         ('b:test_4', 'oops 4')])
+    eq_(items[-2][0].id(), 'a.test_3')
+
+    spill_file = items._file
+    items.close()
+    assert spill_file.closed
+    eq_(len(items), 5)
+
+
+def test_failure_groups():
+    """Failures should group by exception, masked message, and the frames
+    below the test's."""
+    def record(test_line, message, helper_line=None):
+        frames = [('case.py', 197, 'runTest', 'self.test()'),
+                  ('test_a.py', test_line, 'test_%s' % test_line, 'x()')]
+        if helper_line:
+            frames.append(('helper.py', helper_line, 'connect', 'raise'))
+        return FailureRecord('a:test', 'IOError', message, frames)
+
+    groups = FailureGroups()
+    eq_([groups.add(r, 1).number for r in
+         [record(1, 'IOError: refused on 5432\n', 9),
+          record(2, 'IOError: refused on 5433\n', 9),  # same helper frame
+          record(3, 'IOError: refused on 5432\n'),  # raised by the test
+          record(4, 'IOError: refused on 5432\n'),  # ditto, elsewhere
+          record(5, 'IOError: timed out\n', 9),
+          record(6, 'IOError: refused on 1\n', 9)]],
+        [1, 1, 2, 3, 4, 1])
+    eq_([(g.number, g.count, g.exception) for g in groups.repeated()],
+        [(1, 3, 'IOError: refused on 5432')])
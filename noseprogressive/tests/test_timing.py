@@ -0,0 +1,41 @@
+"""Tests for timing tests and fixtures"""
+
+from nose.tools import eq_
+
+from noseprogressive import timing
+from noseprogressive.timing import RateWatch, Timings
+
+
+def test_fixture_and_test_durations():
+    """Setups should run until the next thing starts, and teardowns from the
+    last thing that stopped."""
+    ticks = [0, 1, 3, 6, 10, 15, 21]
+    orig_clock, timing.clock = timing.clock, lambda: ticks.pop(0)
+    try:
+        timings = Timings()                    # 0
+        timings.start_context('pkg')           # 1
+        timings.start_context('pkg.mod')       # 3: pkg setup took 2
+        timings.start_test()                   # 6: pkg.mod setup took 3
+        timings.stop_test('pkg.mod:test_a')    # 10: test took 4
+        timings.stop_context('pkg.mod')        # 15: teardown took 5
+        timings.stop_context('pkg')            # 21: teardown took 6
+    finally:
+        timing.clock = orig_clock
+
+    eq_(timings.slowest(3), [('teardown of pkg', 6),
+                             ('teardown of pkg.mod', 5),
+                             ('pkg.mod:test_a', 4)])
+    eq_(len(timings), 5)
+
+
+def test_rate_watch():
+    """A RateWatch should go off once more than its limit happen within its
+    period, and calm down once they spread out again."""
+    ticks = [0, 0.2, 0.4, 0.6, 2, 2.5, 4]
+    orig_clock, timing.clock = timing.clock, lambda: ticks.pop(0)
+    try:
+        watch = RateWatch(2)
+        eq_([watch.tick() for _ in range(7)],
+            [False, False, True, True, False, False, False])
+    finally:
+        timing.clock = orig_clock
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 """Tests for traceback formatting."""
 
-from noseprogressive.tracebacks import format_traceback
+from blessings import Terminal
+from nose.tools import eq_
+from nose.util import src
+
+from noseprogressive.tracebacks import format_traceback, TracebackFormatter
 
 
 syntax_error_tb = ([
@@ -105,3 +109,41 @@ def test_proxied_syntax_error():
     ], SyntaxError, proxied_syntax_error
     )
     ''.join(format_traceback(*proxied_syntax_tb))
+
+
+def test_partially_formatted_template():
+    """Make sure pre-filling the template leaves literal braces, specs, and
+    attribute lookups working."""
+    term = Terminal(kind='xterm-256color', force_styling=True)
+    formatter = TracebackFormatter(
+        term=term,
+        editor='ed',
+        template=u'{{x}} {editor} {term.bold}{path}:{line_number!r}')
+    eq_(list(formatter.format(*attr_error_tb))[0],
+        u'{x} ed %s/usr/share/PackageKit/helpers/yum/yumBackend.py:2926\n'
+        u'    self.yumbase.getKeyForPackage(pkg, askcb = lambda x, y, z: True)\n'
+        % term.bold)
+
+
+def _indented():
+    if True:
+        x = 1
+        return x
+
+
+def test_source_context():
+    """Frames without source lines should get lines of context around their
+    own from the source cache, with the relative indentation kept."""
+    line_number = _indented.__code__.co_firstlineno + 2
+    formatter = TracebackFormatter(term=Terminal(force_styling=None),
+                                   template=u'{line_number}',
+                                   context=1)
+    eq_(list(formatter.format(
+            [(src(__file__), line_number, '_indented', None)],
+            ValueError,
+            ValueError('no')))[0],
+        u'%s\n'
+        u'    %s  if True:\n'
+        u'  > %s      x = 1\n'
+        u'    %s      return x\n' % tuple(line_number + d for d in
+                                          [0, -1, 0, 1]))
@@ -1,11 +1,15 @@
-from os import chdir, getcwd
+from collections import namedtuple
+from os import chdir, close, getcwd, remove, write
 from os.path import dirname, basename, realpath
+from tempfile import mkstemp
 from unittest import TestCase
 
+from nose.case import FunctionTestCase, Test
 from nose.tools import eq_
 from nose.util import src
 
-from noseprogressive.utils import human_path, index_of_test_frame
+from noseprogressive.utils import (human_path, index_of_test_frame,
+                                   nose_selector, PathCache, SourceCache)
 
 
 class DummyCase(TestCase):
@@ -62,3 +66,105 @@ def test_index_when_syntax_error_below_test_frame():
                                         ('/tests/syntaxerror.py', 1, 1, ':bad\n')),
                             dummy_test),
         1)
+
+
+def test_path_cache():
+    """Make sure the path cache memoizes absolute paths and stays bounded."""
+    calls = []
+
+    def spy(path):
+        calls.append(path)
+        return path.upper()
+
+    cache = PathCache(max_size=2)
+    eq_(cache._lookup(spy, '/a'), '/A')
+    eq_(cache._lookup(spy, '/a'), '/A')
+    eq_(calls, ['/a'])  # Second time came from the cache.
+
+    cache._lookup(spy, 'relative')
+    cache._lookup(spy, 'relative')
+    eq_(calls, ['/a', 'relative', 'relative'])  # Never cached
+
+    cache._lookup(spy, '/b')
+    cache._lookup(spy, '/c')  # Full, so start over.
+    eq_(len(cache._cache), 1)
+
+
+def _generated(x):
+    pass
+
+
+def test_selector_with_huge_args():
+    """Make sure a generated test's arguments are abbreviated in its selector,
+    and that the selector is computed only once."""
+    test = Test(FunctionTestCase(_generated, arg=('x' * 10000,)))
+    selector = nose_selector(test)
+    assert selector.startswith(
+        'noseprogressive.tests.test_utils:_generated(\'xxx')
+    assert len(selector) < 200
+
+    test._progressive_selector = 'cached'
+    eq_(nose_selector(test), 'cached')
+
+
+Point = namedtuple('Point', 'x y')
+
+
+def test_selector_with_namedtuple_args():
+    """Generated tests that differ only in an argument of a class of its own
+    should have different selectors."""
+    eq_([nose_selector(Test(FunctionTestCase(_generated, arg=(Point(x, 2),))))
+         for x in (1, 3)],
+        ['noseprogressive.tests.test_utils:_generated(Point(x=1, y=2),)',
+         'noseprogressive.tests.test_utils:_generated(Point(x=3, y=2),)'])
+
+
+class BrokenRepr(object):
+    def __repr__(self):
+        raise ValueError('Not set up yet')
+
+
+class OldStyleBrokenRepr:
+    def __repr__(self):
+        raise ValueError('Not set up yet')
+
+
+def test_selector_with_broken_repr_args():
+    """Arguments whose repr raises should get their class names, and
+    arguments whose repr is long should be abbreviated."""
+    test = Test(FunctionTestCase(_generated,
+                                 arg=(BrokenRepr(),
+                                      [OldStyleBrokenRepr()],
+                                      Point('x' * 100, None))))
+    eq_(nose_selector(test),
+        "noseprogressive.tests.test_utils:_generated(<BrokenRepr object>, "
+        "[<OldStyleBrokenRepr object>], " +
+        "Point(x='" + 'x' * 29 + '...' + 'x' * 29 + "', y=None))")
+
+
+def test_source_cache():
+    """Lines should come back stripped, nonexistent ones as None, and the
+    cache should stay bounded."""
+    cache = SourceCache(max_files=1)
+    here = src(__file__)
+    eq_(cache.line(here, 1), 'from collections import namedtuple')
+    eq_(cache.line(here, 100000), None)
+    eq_(cache.line('/no/such/file.py', 1), None)
+    eq_(len(cache), 1)  # Reading another file started the cache over.
+    cache.clear()
+    eq_(len(cache), 0)
+
+
+def test_source_cache_truncated_file():
+    """A file cut short after it's cached should give its old lines, not
+    crash."""
+    fd, path = mkstemp(suffix='.py')
+    try:
+        write(fd, b'one = 1\ntwo = 2\n')
+        close(fd)
+        cache = SourceCache()
+        eq_(cache.line(path, 2), 'two = 2')
+        open(path, 'w').close()
+        eq_(cache.line(path, 1), 'one = 1')
+    finally:
+        remove(path)
@@ -0,0 +1,56 @@
+"""Tests for stream wrapping"""
+
+from threading import Thread
+from time import sleep
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from nose.tools import eq_
+
+from noseprogressive.wrapping import OutputThread, QueuedStream
+
+
+def test_queued_streams_keep_order():
+    """Writes to several streams through one thread should land in order."""
+    log = []
+
+    class LoggingStream(StringIO):
+        def write(self, data):
+            log.append((self, data))
+            StringIO.write(self, data)
+
+    one, two = LoggingStream(), LoggingStream()
+    thread = OutputThread(max_chunks=2)
+    queued_one, queued_two = QueuedStream(one, thread), QueuedStream(two, thread)
+    queued_one.write('a')
+    queued_two.write('b')
+    queued_one.write('c')
+    thread.drain()
+    eq_(log, [(one, 'a'), (two, 'b'), (one, 'c')])
+
+    thread.stop()
+    queued_two.write('d')  # Goes straight through now.
+    eq_(two.getvalue(), 'bd')
+
+
+def test_writes_while_stopping():
+    """Writes that come in while the thread is stopping shouldn't be lost or
+    land out of order."""
+    class SlowStream(StringIO):
+        def write(self, data):
+            sleep(0.01)
+            StringIO.write(self, data)
+
+    out = SlowStream()
+    thread = OutputThread()
+    queued = QueuedStream(out, thread)
+    for letter in 'abc':
+        queued.write(letter)
+    stopper = Thread(target=thread.stop)
+    stopper.start()
+    queued.write('d')
+    stopper.join()
+    queued.write('e')
+    eq_(out.getvalue(), 'abcde')
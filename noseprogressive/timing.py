@@ -0,0 +1,112 @@
+"""Timing of tests and their fixtures"""
+
+from array import array
+from collections import deque
+from heapq import nlargest
+try:
+    from time import monotonic as clock
+except ImportError:  # Python < 3.3
+    from time import time as clock
+
+from nose.util import isclass
+
+
+__all__ = ['clock', 'context_name', 'RateWatch', 'Timings']
+
+
+class Timings(object):
+    """How long each test and each context fixture took during a run
+
+    Durations live in an array of doubles, kinds in an array of bytes, and
+    names in a plain list, so the only per-test cost beyond a couple of clock
+    readings is three appends. Names are the test selectors we compute for the
+    bar anyway, so they cost nothing extra to keep.
+
+    A context's setup time runs from ``start_context()`` to whatever comes
+    next; its teardown time, from whatever came last until
+    ``stop_context()``. nose's plugin hooks don't bracket fixtures any more
+    tightly than that.
+
+    """
+    TEST, SETUP, TEARDOWN = 0, 1, 2
+    LABELS = {SETUP: 'setup of ', TEARDOWN: 'teardown of ', TEST: ''}
+
+    def __init__(self):
+        self.names = []
+        self.kinds = array('B')
+        self.durations = array('d')
+        self._mark = clock()  # when the last thing started or stopped
+        self._setting_up = None  # name of the context whose setup is running
+
+    def __len__(self):
+        return len(self.durations)
+
+    def _record(self, kind, name, duration):
+        self.names.append(name)
+        self.kinds.append(kind)
+        self.durations.append(duration)
+
+    def _finish_setup(self, now):
+        if self._setting_up is not None:
+            self._record(self.SETUP, self._setting_up, now - self._mark)
+            self._setting_up = None
+
+    def start_context(self, name):
+        now = clock()
+        self._finish_setup(now)
+        self._setting_up = name
+        self._mark = now
+
+    def stop_context(self, name):
+        now = clock()
+        self._finish_setup(now)
+        self._record(self.TEARDOWN, name, now - self._mark)
+        self._mark = now
+
+    def start_test(self):
+        now = clock()
+        self._finish_setup(now)
+        self._mark = now
+
+    def stop_test(self, name):
+        """Record a test's duration, and return it."""
+        now = clock()
+        duration = now - self._mark
+        self._record(self.TEST, name, duration)
+        self._mark = now
+        return duration
+
+    def slowest(self, count):
+        """Return the ``count`` slowest things, slowest first, as (label,
+        duration) pairs."""
+        durations = self.durations
+        return [(self.LABELS[self.kinds[i]] + self.names[i], durations[i])
+                for i in nlargest(count,
+                                  range(len(durations)),
+                                  key=durations.__getitem__)]
+
+
+class RateWatch(object):
+    """A detector of something happening more than ``limit`` times within
+    ``period`` seconds"""
+
+    def __init__(self, limit, period=1.0):
+        self.limit = limit
+        self.period = period
+        self._times = deque(maxlen=limit + 1)  # the latest few happenings
+
+    def tick(self):
+        """Note that the thing happened, and return whether it's happening
+        too often."""
+        now = clock()
+        times = self._times
+        times.append(now)
+        return len(times) > self.limit and now - times[0] <= self.period
+
+
+def context_name(context):
+    """Return a selector-like name for a module or class context."""
+    name = getattr(context, '__name__', None) or repr(context)
+    if isclass(context):
+        return '%s:%s' % (getattr(context, '__module__', '?'), name)
+    return name
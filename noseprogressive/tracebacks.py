@@ -1,14 +1,14 @@
 """Fancy traceback formatting"""
 
 import os
+from string import Formatter
 from sys import version_info
 
-from traceback import extract_tb, format_exception_only
+import linecache
+from traceback import format_exception_only
 
 from blessings import Terminal
-from nose.util import src
-
-from noseprogressive.utils import human_path
+from noseprogressive.utils import human_path, path_cache, source_cache
 
 
 DEFAULT_EDITOR_SHORTCUT_TEMPLATE = (u'  {dim_format}{editor} '
@@ -26,7 +26,8 @@ def format_traceback(extracted_tb,
                      function_color=12,
                      dim_color=8,
                      editor='vi',
-                     template=DEFAULT_EDITOR_SHORTCUT_TEMPLATE):
+                     template=DEFAULT_EDITOR_SHORTCUT_TEMPLATE,
+                     context=0):
     """Return an iterable of formatted Unicode traceback frames.
 
     Also include a pseudo-frame at the end representing the exception itself.
@@ -34,65 +35,170 @@ def format_traceback(extracted_tb,
     Format things more compactly than the stock formatter, and make every
     frame an editor shortcut.
 
+    This is a convenience for one-off use. To format many tracebacks, make a
+    ``TracebackFormatter`` once, and reuse it.
+
     """
-    def format_shortcut(editor,
-                        path,
-                        line_number,
-                        function=None):
-        """Return a pretty-printed editor shortcut."""
-        return template.format(editor=editor,
-                               line_number=line_number or 0,
-                               path=path,
-                               function=function or u'',
-                               hash_if_function=u'  # ' if function else u'',
-                               function_format=term.color(function_color),
-                               # Underline is also nice and doesn't make us
-                               # worry about appearance on different background
-                               # colors.
-                               normal=term.normal,
-                               dim_format=term.color(dim_color) + term.bold,
-                               line_number_max_width=line_number_max_width,
-                               term=term)
-
-    template += '\n'  # Newlines are awkward to express on the command line.
-    extracted_tb = _unicode_decode_extracted_tb(extracted_tb)
-    if not term:
-        term = Terminal()
-
-    if extracted_tb:
-        # Shorten file paths:
-        for i, (file, line_number, function, text) in enumerate(extracted_tb):
-            extracted_tb[i] = human_path(src(file), cwd), line_number, function, text
-
-        line_number_max_width = len(unicode(max(the_line for _, the_line, _, _ in extracted_tb)))
-
-        # Stack frames:
-        for i, (path, line_number, function, text) in enumerate(extracted_tb):
-            text = (text and text.strip()) or u''
-
-            yield (format_shortcut(editor, path, line_number, function) +
-                   (u'    %s\n' % text))
-
-    # Exception:
-    if exc_type is SyntaxError:
-        # Format a SyntaxError to look like our other traceback lines.
-        # SyntaxErrors have a format different from other errors and include a
-        # file path which looks out of place in our newly highlit, editor-
-        # shortcutted world.
-        if hasattr(exc_value, 'filename') and hasattr(exc_value, 'lineno'):
-            exc_lines = [format_shortcut(editor, exc_value.filename, exc_value.lineno)]
-            formatted_exception = format_exception_only(SyntaxError, exc_value)[1:]
+    return TracebackFormatter(cwd,
+                              term,
+                              function_color,
+                              dim_color,
+                              editor,
+                              template,
+                              context).format(extracted_tb, exc_type, exc_value)
+
+
+class TracebackFormatter(object):
+    """A traceback formatter which does all its preparation up front
+
+    Terminal capabilities are looked up once, and the parts of the editor
+    shortcut template that don't vary from frame to frame are filled in once,
+    leaving as little as possible to do per frame.
+
+    With ``context``, each frame shows that many lines of source on either
+    side of its own, rather than just its own.
+
+    """
+    def __init__(self,
+                 cwd='',
+                 term=None,
+                 function_color=12,
+                 dim_color=8,
+                 editor='vi',
+                 template=DEFAULT_EDITOR_SHORTCUT_TEMPLATE,
+                 context=0):
+        if not term:
+            term = Terminal()
+        self._cwd = cwd
+        self._context = context
+        self._constants = dict(
+            editor=editor,
+            function_format=term.color(function_color),
+            # Underline is also nice and doesn't make us worry about
+            # appearance on different background colors.
+            normal=term.normal,
+            dim_format=term.color(dim_color) + term.bold,
+            term=term)
+        # Newlines are awkward to express on the command line.
+        self._template = _partially_format(template + '\n', self._constants)
+
+    def format(self, extracted_tb, exc_type, exc_value):
+        """Return an iterable of formatted Unicode traceback frames.
+
+        Also include a pseudo-frame at the end representing the exception
+        itself.
+
+        """
+        # Decode and shorten file paths in one go:
+        cwd = self._cwd
+        extracted_tb = [(human_path(path_cache.src(_decode(file)), cwd),
+                         line_number,
+                         _decode(function),
+                         file,
+                         text)
+                        for file, line_number, function, text in extracted_tb]
+        line_number_max_width = 0
+
+        if extracted_tb:
+            line_number_max_width = len(unicode(max(the_line for _, the_line, _, _, _ in extracted_tb)))
+
+            # Stack frames:
+            for path, line_number, function, file, text in extracted_tb:
+                yield (self._format_shortcut(path,
+                                             line_number,
+                                             function,
+                                             line_number_max_width) +
+                       self._format_source(file, line_number, text))
+
+        # Exception:
+        if exc_type is SyntaxError:
+            # Format a SyntaxError to look like our other traceback lines.
+            # SyntaxErrors have a format different from other errors and include a
+            # file path which looks out of place in our newly highlit, editor-
+            # shortcutted world.
+            if hasattr(exc_value, 'filename') and hasattr(exc_value, 'lineno'):
+                exc_lines = [self._format_shortcut(exc_value.filename,
+                                                   exc_value.lineno,
+                                                   line_number_max_width=line_number_max_width)]
+                formatted_exception = format_exception_only(SyntaxError, exc_value)[1:]
+            else:
+                # The logcapture plugin may format exceptions as strings,
+                # stripping them of the full filename and lineno
+                exc_lines = []
+                formatted_exception = format_exception_only(SyntaxError, exc_value)
+                formatted_exception.append(u'(Try --nologcapture for a more detailed traceback)\n')
         else:
-            # The logcapture plugin may format exceptions as strings,
-            # stripping them of the full filename and lineno
             exc_lines = []
-            formatted_exception = format_exception_only(SyntaxError, exc_value)
-            formatted_exception.append(u'(Try --nologcapture for a more detailed traceback)\n')
-    else:
-        exc_lines = []
-        formatted_exception = format_exception_only(exc_type, exc_value)
-    exc_lines.extend([_decode(f) for f in formatted_exception])
-    yield u''.join(exc_lines)
+            formatted_exception = format_exception_only(exc_type, exc_value)
+        exc_lines.extend([_decode(f) for f in formatted_exception])
+        yield u''.join(exc_lines)
+
+    def _format_source(self, file, line_number, text):
+        """Return the source line of a frame, indented, or several lines
+        around it if we're showing context."""
+        if self._context and line_number and text is None:
+            first = max(1, line_number - self._context)
+            lines = [_decode(line) for line in
+                     source_cache.lines(file,
+                                        first,
+                                        line_number + self._context)]
+            if lines:
+                # Keep the lines' relative indentation, but no more.
+                indent = min([len(line) - len(line.lstrip())
+                              for line in lines if line.strip()] or [0])
+                width = len(unicode(first + len(lines) - 1))
+                constants = self._constants
+                return u''.join(
+                    (u'  > %*d  %s\n' % (width, number, line[indent:])
+                     if number == line_number else
+                     u'%s    %*d  %s%s\n' % (constants['dim_format'],
+                                             width,
+                                             number,
+                                             line[indent:],
+                                             constants['normal']))
+                    for number, line in enumerate(lines, first))
+        return u'    %s\n' % _decode(source_line(file, line_number, text) or
+                                    u'')
+
+    def _format_shortcut(self,
+                         path,
+                         line_number,
+                         function=None,
+                         line_number_max_width=0):
+        """Return a pretty-printed editor shortcut."""
+        fields = self._constants.copy()
+        fields.update(line_number=line_number or 0,
+                      path=path,
+                      function=function or u'',
+                      hash_if_function=u'  # ' if function else u'',
+                      line_number_max_width=line_number_max_width)
+        return self._template.format(**fields)
+
+
+def _partially_format(template, constants):
+    """Return ``template`` with the fields named in ``constants`` filled in
+    and all others left alone for a later ``format()`` call.
+
+    Fields with a conversion or format spec are left alone as well, as are
+    attribute and index lookups like ``{term.bold}``.
+
+    """
+    def escaped(text):
+        return text.replace(u'{', u'{{').replace(u'}', u'}}')
+
+    parts = []
+    for literal, field, spec, conversion in Formatter().parse(template):
+        parts.append(escaped(literal))
+        if field is None:
+            continue
+        if (field in constants and isinstance(constants[field], basestring)
+            and not spec and not conversion):
+            parts.append(escaped(_decode(constants[field])))
+        else:
+            parts.append(u'{%s%s%s}' % (field,
+                                       u'!' + conversion if conversion else u'',
+                                       u':' + spec if spec else u''))
+    return u''.join(parts)
 
 
 # Adapted from unittest:
@@ -102,15 +208,68 @@ def extract_relevant_tb(tb, exctype, is_test_failure):
 
     This used to be _exc_info_to_string().
 
+    """
+    return list(relevant_frames(tb, is_test_failure))
+
+
+def relevant_frames(tb, is_test_failure):
+    """Yield (path, line number, function, source line) for each frame of a
+    traceback that isn't a unittest one, walking it just once.
+
+    Leading unittest frames are the test runner's. For a test failure, the
+    trailing ones are assert*()'s, and we leave them out, too. To tell
+    whether a run of unittest frames is trailing, we hang onto it until we
+    see what comes next.
+
+    Unlike its namesake in unittest, this doesn't stop at the first unittest
+    frame after the test's, which means we don't bail out as soon as somebody
+    uses the mock library, which defines ``__unittest``.
+
     """
     # Skip test runner traceback levels:
     while tb and _is_unittest_frame(tb):
         tb = tb.tb_next
-    if is_test_failure:
-        # Skip assert*() traceback levels:
-        length = _count_relevant_tb_levels(tb)
-        return extract_tb(tb, length)
-    return extract_tb(tb)
+    held = []  # unittest frames that might be trailing
+    while tb is not None:
+        frame = _extract_frame(tb)
+        if is_test_failure and _is_unittest_frame(tb):
+            held.append(frame)
+        else:
+            for held_frame in held:
+                yield held_frame
+            held = []
+            yield frame
+        tb = tb.tb_next
+
+
+def _extract_frame(tb):
+    """Return the (path, line number, function, source line) of a traceback
+    entry, as ``extract_tb()`` would, except leave the source line None if
+    ``source_line()`` can fetch it later."""
+    frame = tb.tb_frame
+    code = frame.f_code
+    file = code.co_filename
+    line_number = tb.tb_lineno
+    if path_cache.isfile(file):
+        line = None
+    else:
+        # Perhaps it's in a zipped egg. Only the module's loader knows, and
+        # we can get at that only while we have the frame.
+        linecache.checkcache(file)
+        line = linecache.getline(file, line_number, frame.f_globals)
+        line = line.strip() if line else None
+    return file, line_number, code.co_name, line
+
+
+def source_line(file, line_number, text=None):
+    """Return the stripped source line an extracted frame points to, or None.
+
+    :arg text: The source line, if the frame came with it
+
+    """
+    if text is not None:
+        return text.strip()
+    return source_cache.line(file, line_number)
 
 
 def _decode(string):
@@ -128,31 +287,6 @@ def _decode(string):
     return string if isinstance(string, unicode) else string.decode('utf-8', 'replace')
 
 
-def _unicode_decode_extracted_tb(extracted_tb):
-    """Return a traceback with the string elements translated into Unicode."""
-    return [(_decode(file), line_number, _decode(function), _decode(text))
-            for file, line_number, function, text in extracted_tb]
-
-
 def _is_unittest_frame(tb):
     """Return whether the given frame is something other than a unittest one."""
     return '__unittest' in tb.tb_frame.f_globals
-
-
-def _count_relevant_tb_levels(tb):
-    """Return the number of frames in ``tb`` before all that's left is unittest frames.
-
-    Unlike its namesake in unittest, this doesn't bail out as soon as it hits a
-    unittest frame, which means we don't bail out as soon as somebody uses the
-    mock library, which defines ``__unittest``.
-
-    """
-    length = contiguous_unittest_frames = 0
-    while tb:
-        length += 1
-        if _is_unittest_frame(tb):
-            contiguous_unittest_frames += 1
-        else:
-            contiguous_unittest_frames = 0
-        tb = tb.tb_next
-    return length - contiguous_unittest_frames
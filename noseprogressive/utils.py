@@ -1,12 +1,272 @@
-from os.path import abspath, realpath
+from __future__ import with_statement
+from array import array
+from errno import EEXIST
+import json
+from os import makedirs, rename
+from os.path import abspath, dirname, isabs, isfile, realpath
+try:
+    from repr import Repr
+except ImportError:
+    from reprlib import Repr
 
 from nose.tools import nottest
 import nose.util
 
 
+class PathCache(object):
+    """Memoized versions of the path functions we call for every frame of
+    every traceback
+
+    Mass-failure runs show the same handful of files thousands of times, so
+    this turns a lot of syscalls into dict lookups. Relative paths aren't
+    cached, since what they mean changes with the cwd. To stay bounded, the
+    cache starts over when it fills up.
+
+    """
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        """Forget everything, say because a new test run is starting."""
+        self._cache = {}
+
+    def _lookup(self, function, path):
+        if not path or not isabs(path):
+            return function(path)
+        key = function, path
+        try:
+            return self._cache[key]
+        except KeyError:
+            if len(self._cache) >= self.max_size:
+                self.clear()
+            value = self._cache[key] = function(path)
+            return value
+
+    def abspath(self, path):
+        return self._lookup(abspath, path)
+
+    def realpath(self, path):
+        return self._lookup(realpath, path)
+
+    def isfile(self, path):
+        return self._lookup(isfile, path)
+
+    def src(self, path):
+        """Return the source file corresponding to a .pyc path, as
+        ``nose.util.src()`` does."""
+        return self._lookup(nose.util.src, path)
+
+
+# Shared by everybody who formats tracebacks:
+path_cache = PathCache()
+
+
+class SourceCache(object):
+    """The source lines that traceback frames point to, read from disk only
+    when a frame is printed
+
+    ``extract_tb()`` reads the source of every frame it extracts through
+    ``linecache``, which never forgets a file. We read only what's shown.
+    Each file is read whole, and the offsets of its lines are indexed the
+    first time it's needed, so showing lines of context around thousands of
+    frames never reads or splits a file twice. At most ``max_files`` files
+    are kept, starting over when full.
+
+    Files aren't memory-mapped, though that would save a copy: truncating a
+    mapped file, as an editor saving it mid-run might, crashes the process
+    with SIGBUS the next time we look at it.
+
+    """
+    def __init__(self, max_files=64):
+        self.max_files = max_files
+        self._files = {}
+
+    def __len__(self):
+        """Return how many files I'm holding onto."""
+        return len(self._files)
+
+    def clear(self):
+        """Forget everything, say because a new test run is starting."""
+        self._files = {}
+
+    def _source(self, path):
+        """Return a file's (contents, line offsets), or None if it can't be
+        read.
+
+        The offsets are where each line starts, plus one past the end of the
+        last.
+
+        """
+        try:
+            return self._files[path]
+        except KeyError:
+            pass
+        if len(self._files) >= self.max_files:
+            self.clear()
+        source = None
+        try:
+            with open(path, 'rb') as file:
+                source = file.read()
+        except (IOError, OSError):
+            pass
+        else:
+            offsets = array('l', [0])
+            find = source.find
+            start = 0
+            while True:
+                newline = find(b'\n', start)
+                if newline == -1:
+                    break
+                start = newline + 1
+                offsets.append(start)
+            if offsets[-1] != len(source):  # no newline at the end
+                offsets.append(len(source) + 1)
+            source = source, offsets
+        self._files[path] = source
+        return source
+
+    def lines(self, path, first, last):
+        """Return lines ``first`` through ``last`` of a file, counting from
+        1, or as many of them as there are.
+
+        Lines come back as native strings, undecoded in Python 2, as
+        ``linecache`` would return them, without their line endings.
+
+        """
+        if not path:
+            return []
+        source = self._source(path)
+        if source is None:
+            return []
+        data, offsets = source
+        first = max(first, 1)
+        last = min(last, len(offsets) - 1)
+        lines = [data[offsets[i - 1]:offsets[i] - 1].rstrip(b'\r')
+                 for i in range(first, last + 1)]
+        if lines and not isinstance(lines[0], str):  # Python 3
+            lines = [line.decode('utf-8', 'replace') for line in lines]
+        return lines
+
+    def line(self, path, line_number):
+        """Return the given line of a file, stripped, or None if there's no
+        such thing."""
+        if not line_number:
+            return None
+        lines = self.lines(path, line_number, line_number)
+        return (lines and lines[0].strip()) or None
+
+
+source_cache = SourceCache()
+
+
+def load_json(path):
+    """Return the JSON data in the file at ``path``, None if it isn't there or
+    is corrupt."""
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        return None
+
+
+def save_json(path, data):
+    """Write ``data`` as JSON to ``path``, making directories as needed.
+
+    Write and rename, so a concurrent run never sees half a file. Return
+    whether it worked; failing to write is not worth interrupting a test run
+    over.
+
+    """
+    try:
+        try:
+            makedirs(dirname(path))
+        except OSError as exc:
+            if exc.errno != EEXIST:
+                raise
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(data, file)
+        rename(temp_path, path)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def as_unicode(s):
+    """Return ``s`` as unicode, decoding it as UTF-8 if it's bytes.
+
+    Test output, exception messages, and Python 2 source lines come in any
+    encoding; undecodable bytes turn into replacement characters rather than
+    errors.
+
+    """
+    if isinstance(s, bytes):
+        return s.decode('utf-8', 'replace')
+    return s
+
+
+class _ArgRepr(Repr):
+    """A ``Repr`` that gets by when an argument's ``__repr__`` raises
+
+    Such an argument gets just its class name: not its address, as ``Repr``
+    would give it, since the selector has to be the same from run to run.
+
+    """
+    def repr1(self, x, level):
+        # Python 2's Repr hands only old-style instances to repr_instance().
+        if hasattr(self, 'repr_' + '_'.join(type(x).__name__.split())):
+            return Repr.repr1(self, x, level)  # A container, say
+        return self.repr_instance(x, level)
+
+    def repr_instance(self, x, level):
+        try:
+            s = repr(x)
+        except Exception:
+            return '<%s object>' % getattr(x, '__class__', type(x)).__name__
+        if len(s) > self.maxother:
+            i = max(0, (self.maxother - 3) // 2)
+            j = max(0, self.maxother - 3 - i)
+            s = s[:i] + '...' + s[len(s) - j:]
+        return s
+
+
+# How much of a generated test's arguments to show in its selector. Some
+# generators yield enormous things, which take forever to repr.
+_arg_repr = _ArgRepr()
+_arg_repr.maxlevel = 3
+_arg_repr.maxtuple = _arg_repr.maxlist = _arg_repr.maxarray = 10
+_arg_repr.maxdict = _arg_repr.maxset = _arg_repr.maxfrozenset = 5
+_arg_repr.maxstring = _arg_repr.maxother = 80
+_arg_repr.maxlong = 40
+
+
+def _memoized_on(test, attr, compute):
+    """Return ``compute(test)``, remembering it on ``test`` as ``attr`` so we
+    needn't compute it again the next time somebody asks."""
+    try:
+        return getattr(test, attr)
+    except AttributeError:
+        pass
+    value = compute(test)
+    try:
+        setattr(test, attr, value)
+    except AttributeError:  # Some oddball with __slots__
+        pass
+    return value
+
+
 @nottest
 def test_address(test):
-    """Return the result of nose's test_address(), None if it's stumped."""
+    """Return the result of nose's test_address(), None if it's stumped.
+
+    The result is cached on the test, since nose's introspection isn't cheap.
+
+    """
+    return _memoized_on(test, '_progressive_address', _uncached_test_address)
+
+
+def _uncached_test_address(test):
     try:
         return nose.util.test_address(test)
     except TypeError:  # Explodes if the function passed to @with_setup applied
@@ -18,9 +278,14 @@ def nose_selector(test):
     """Return the string you can pass to nose to run `test`, including argument
     values if the test was made by a test generator.
 
-    Return "Unknown test" if it can't construct a decent path.
+    Return "Unknown test" if it can't construct a decent path. The result is
+    cached on the test, since we ask for it at least once per test.
 
     """
+    return _memoized_on(test, '_progressive_selector', _uncached_nose_selector)
+
+
+def _uncached_nose_selector(test):
     address = test_address(test)
     if address:
         file, module, rest = address
@@ -28,9 +293,12 @@ def nose_selector(test):
         if module:
             if rest:
                 try:
-                    return '%s:%s%s' % (module, rest, test.test.arg or '')
+                    arg = test.test.arg
                 except AttributeError:
                     return '%s:%s' % (module, rest)
+                return '%s:%s%s' % (module,
+                                    rest,
+                                    _arg_repr.repr(arg) if arg else '')
             else:
                 return module
     return 'Unknown test'
@@ -61,6 +329,63 @@ class OneTrackMind(object):
         return self
 
 
+@nottest
+class TestFrameFinder(object):
+    """A finder of the frame in a traceback that points to the failed test,
+    shown the frames one at a time
+
+    That way, it can look for the test frame while somebody else is walking
+    the traceback anyway. It takes its best guess.
+
+    """
+    def __init__(self, test):
+        self.best = None  # the index of the test frame, once we know it
+        self.done = False  # whether we're sure
+
+        try:
+            address = test_address(test)
+        except TypeError:
+            # Explodes if the function passed to @with_setup
+            # applied to a test generator has an error.
+            address = None
+
+        # address is None if the test callable couldn't be found. No sense
+        # trying to find the test frame if there's no such thing:
+        if address is None or address[0] is None:
+            self.done = True
+            return
+
+        test_file, _, test_call = address
+        self._test_file_path = path_cache.realpath(test_file)
+        self._test_function = (test_call.rsplit('.')[-1]
+                               if hasattr(test_call, 'rsplit')  # can be None
+                               else None)
+        # OneTrackMind helps us favor the latest frame, even if there's more
+        # than one match of equal confidence.
+        self._knower = OneTrackMind()
+
+    def see(self, index, file, function):
+        """Consider the frame at ``index``, from ``file`` and in
+        ``function``."""
+        # TODO: Perfect. Right now, I'm just comparing by function name within
+        # a module. This should break only if you have two identically-named
+        # functions from a single module in the call stack when your test
+        # fails. However, it bothers me. I'd rather be finding the actual
+        # callables and comparing them directly, but that might not work with
+        # test generators.
+        if (self.done or file is None or
+            self._test_file_path != path_cache.realpath(file)):
+            return
+        # TODO: Now that we're eliding until the test frame, is it desirable
+        # to have this confidence-2 guess when just the file path is matched?
+        self._knower.know(index, 2)
+        if (self._test_function is not None and
+            function == self._test_function):
+            self._knower.know(index, 3)
+            self.done = True
+        self.best = self._knower.best
+
+
 @nottest  # still needed?
 def index_of_test_frame(extracted_tb, exception_type, exception_value, test):
     """Return the index of the frame that points to the failed test or None.
@@ -77,45 +402,12 @@ def index_of_test_frame(extracted_tb, exception_type, exception_value, test):
             extract_tb()
 
     """
-    try:
-        address = test_address(test)
-    except TypeError:
-        # Explodes if the function passed to @with_setup
-        # applied to a test generator has an error.
-        address = None
-
-    # address is None if the test callable couldn't be found. No sense trying
-    # to find the test frame if there's no such thing:
-    if address is None:
-        return None
-
-    test_file, _, test_call = address
-
-    # OneTrackMind helps us favor the latest frame, even if there's more than
-    # one match of equal confidence.
-    knower = OneTrackMind()
-
-    if test_file is not None:
-        test_file_path = realpath(test_file)
-
-        # TODO: Perfect. Right now, I'm just comparing by function name within
-        # a module. This should break only if you have two identically-named
-        # functions from a single module in the call stack when your test
-        # fails. However, it bothers me. I'd rather be finding the actual
-        # callables and comparing them directly, but that might not work with
-        # test generators.
-        for i, frame in enumerate(extracted_tb):
-            file, line, function, text = frame
-            if file is not None and test_file_path == realpath(file):
-                # TODO: Now that we're eliding until the test frame, is it
-                # desirable to have this confidence-2 guess when just the file
-                # path is matched?
-                knower.know(i, 2)
-                if (hasattr(test_call, 'rsplit') and  # test_call can be None
-                    function == test_call.rsplit('.')[-1]):
-                    knower.know(i, 3)
-                    break
-    return knower.best
+    finder = TestFrameFinder(test)
+    for i, (file, _, function, _) in enumerate(extracted_tb):
+        if finder.done:
+            break
+        finder.see(i, file, function)
+    return finder.best
 
 
 def human_path(path, cwd):
@@ -126,7 +418,7 @@ def human_path(path, cwd):
 
     """
     # TODO: Canonicalize the path to remove /kitsune/../kitsune nonsense.
-    path = abspath(path)
+    path = path_cache.abspath(path)
     if cwd and path.startswith(cwd):
         path = path[len(cwd) + 1:]  # Make path relative. Remove leading slash.
     return path
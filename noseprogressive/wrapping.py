@@ -5,6 +5,11 @@ import __builtin__
 import cmd
 import pdb
 import sys
+from threading import current_thread, Lock, Thread
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 
 
 def cmdloop(self, *args, **kwargs):
@@ -52,7 +57,14 @@ def set_trace(*args, **kwargs):
 
     """
     # There's no stream attr if capture plugin is enabled:
-    out = sys.stdout.stream if hasattr(sys.stdout, 'stream') else None
+    if hasattr(sys.stdout, 'stream'):
+        # Get out anything the bar or the output thread is holding back:
+        sys.stdout.flush()
+        if hasattr(sys.stdout, 'drain'):  # Somebody else's wrapper may not.
+            sys.stdout.drain()
+        out = sys.stdout.stream
+    else:
+        out = None
 
     # Python 2.5 can't put an explicit kwarg and **kwargs in the same function
     # call.
@@ -70,17 +82,126 @@ class StreamWrapper(object):
     """Wrapper for stdout/stderr to do progress bar dodging"""
     # An outer class so isinstance() works in begin()
 
-    def __init__(self, stream, plugin):
+    def __init__(self, stream, plugin, out=None):
+        """Wrap ``stream``.
+
+        :arg out: Where to actually send writes, if not straight to
+            ``stream``: for example, a ``QueuedStream`` in front of it
+
+        """
         self.stream = stream
         self._plugin = plugin
+        self._out = stream if out is None else out
 
     def __getattr__(self, name):
         return getattr(self.stream, name)
 
     def write(self, data):
         if hasattr(self._plugin, 'bar'):
-            with self._plugin.bar.dodging():
-                self.stream.write(data)
+            self._plugin.bar.write(self._out, data)
         else:
             # Some things write to stderr before the bar is inited.
-            self.stream.write(data)
+            self._out.write(data)
+
+    def flush(self):
+        if hasattr(self._plugin, 'bar'):
+            # The bar may be sitting on some of our output.
+            self._plugin.bar.flush_writes()
+        self._out.flush()
+
+    def drain(self):
+        """Wait until everything written so far has really been written."""
+        if self._out is not self.stream:
+            self._out.drain()
+
+
+class OutputThread(object):
+    """A thread that does the actual writing to the terminal
+
+    Handing it output lets tests keep running while a slow terminal, SSH link,
+    or pipe catches up. It keeps no more than ``max_chunks`` writes waiting;
+    past that, writers block until it catches up.
+
+    """
+    def __init__(self, max_chunks=10000):
+        self._queue = Queue(max_chunks)
+        self.is_stopped = False
+        # Keeps anything from being queued after the thread is told to stop:
+        self._lock = Lock()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True  # Never keep the process alive.
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            method, args = self._queue.get()
+            try:
+                if method is None:
+                    return
+                method(*args)
+            except Exception:
+                # There's nobody to tell, and a broken terminal shouldn't
+                # take the test run down with it.
+                pass
+            finally:
+                self._queue.task_done()
+
+    def call(self, method, *args):
+        """Arrange for ``method(*args)`` to be called, after everything
+        previously arranged, on the output thread.
+
+        Once I've been stopped, call it right here instead, as soon as the
+        thread has finished what it already had.
+
+        """
+        with self._lock:
+            if not self.is_stopped:
+                self._queue.put((method, args))
+                return
+        if current_thread() is not self._thread:
+            self._thread.join()
+        method(*args)
+
+    def drain(self):
+        """Wait for all the output handed to me so far to be written."""
+        if not self.is_stopped:
+            self._queue.join()
+
+    def stop(self):
+        """Write out everything outstanding, and then shut down.
+
+        Later writes through my ``QueuedStream``s go straight to their
+        streams.
+
+        """
+        with self._lock:
+            if self.is_stopped:
+                return
+            self.is_stopped = True
+            self._queue.put((None, ()))
+        self._thread.join()
+
+
+class QueuedStream(object):
+    """A stream proxy that does its writing on an ``OutputThread``
+
+    Everything but ``write()`` and ``flush()`` goes straight to the stream, so
+    things like ``isatty()`` and ``fileno()`` still work.
+
+    """
+    def __init__(self, stream, output_thread):
+        self.stream = stream
+        self._thread = output_thread
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def write(self, data):
+        self._thread.call(self.stream.write, data)
+
+    def flush(self):
+        self._thread.call(self.stream.flush)
+
+    def drain(self):
+        """Wait until everything written so far has really been written."""
+        self._thread.drain()